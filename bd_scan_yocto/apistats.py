@@ -0,0 +1,202 @@
+import re
+import json
+import time
+import logging
+import threading
+import requests
+from urllib.parse import urlparse
+
+from bd_scan_yocto import global_values
+
+# Histogram bucket upper bounds (seconds)
+BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+TOP_COUNT = 10
+
+# Path segments replaced in endpoint templates (UUIDs, numeric IDs, vulnerability and hash IDs)
+id_regex = re.compile(r'^([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|\d+|[0-9a-f]{32,}|'
+                      r'(BDSA|CVE)-\d+-\d+)$', re.IGNORECASE)
+
+stats = {}
+stats_lock = threading.Lock()
+
+
+def get_template(url):
+    path = urlparse(url).path
+    return '/'.join('{id}' if id_regex.match(segment) else segment for segment in path.split('/'))
+
+
+def get_entry(key):
+    if key not in stats:
+        stats[key] = {
+            'count': 0,
+            'status': {},
+            'bytes': 0,
+            'seconds': 0.0,
+            'max_seconds': 0.0,
+            'buckets': [0] * len(BUCKETS),
+        }
+    return stats[key]
+
+
+def record(method, url, status, seconds):
+    key = (global_values.api_phase, method, get_template(url))
+    with stats_lock:
+        entry = get_entry(key)
+        entry['count'] += 1
+        entry['status'][str(status)] = entry['status'].get(str(status), 0) + 1
+        entry['seconds'] += seconds
+        entry['max_seconds'] = max(entry['max_seconds'], seconds)
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                entry['buckets'][index] += 1
+                break
+    return key
+
+
+def add_bytes(key, size):
+    with stats_lock:
+        get_entry(key)['bytes'] += size
+
+
+def get_records():
+    records = []
+    with stats_lock:
+        for (rphase, method, endpoint), entry in sorted(stats.items()):
+            records.append(dict(entry, phase=rphase, method=method, endpoint=endpoint))
+    return records
+
+
+def write_json(path, records):
+    with open(path, 'w') as f:
+        json.dump({'buckets': BUCKETS, 'requests': records}, f, indent=4)
+
+
+def get_labels(record, name='', value=''):
+    labels = f'phase="{record["phase"]}",method="{record["method"]}",endpoint="{record["endpoint"]}"'
+    if name != '':
+        labels += f',{name}="{value}"'
+    return labels
+
+
+def write_openmetrics(path, records):
+    lines = ['# TYPE bd_api_request_duration_seconds histogram', '# UNIT bd_api_request_duration_seconds seconds']
+    for record in records:
+        cumulative = 0
+        for bound, count in zip(BUCKETS, record['buckets']):
+            cumulative += count
+            lines.append(f"bd_api_request_duration_seconds_bucket{{{get_labels(record, 'le', bound)}}} {cumulative}")
+        lines.append(f"bd_api_request_duration_seconds_bucket{{{get_labels(record, 'le', '+Inf')}}} {record['count']}")
+        lines.append(f"bd_api_request_duration_seconds_count{{{get_labels(record)}}} {record['count']}")
+        lines.append(f"bd_api_request_duration_seconds_sum{{{get_labels(record)}}} {record['seconds']:.6f}")
+    lines.append('# TYPE bd_api_requests counter')
+    for record in records:
+        for status, count in sorted(record['status'].items()):
+            lines.append(f"bd_api_requests_total{{{get_labels(record, 'status', status)}}} {count}")
+    lines.append('# TYPE bd_api_response_bytes counter')
+    lines.append('# UNIT bd_api_response_bytes bytes')
+    for record in records:
+        lines.append(f"bd_api_response_bytes_total{{{get_labels(record)}}} {record['bytes']}")
+    lines.append('# EOF')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def report():
+    records = get_records()
+    if len(records) == 0:
+        return
+
+    total = sum(record['count'] for record in records)
+    logging.info(f"Black Duck API calls: {total} requests, "
+                 f"{sum(record['seconds'] for record in records):.1f} seconds waiting for responses")
+    phases = {}
+    for record in records:
+        phases[record['phase']] = phases.get(record['phase'], 0) + record['count']
+    logging.info("- Requests by phase: " + ', '.join(f"{name} {count}" for name, count in phases.items()))
+    logging.info("- Slowest endpoints (mean response time):")
+    for record in sorted(records, key=lambda r: r['seconds'] / r['count'], reverse=True)[:TOP_COUNT]:
+        logging.info(f"  {record['seconds'] / record['count']:6.2f}s mean {record['max_seconds']:6.2f}s max "
+                     f"{record['count']:6d} calls {record['bytes'] / 1024:9.0f} KB  "
+                     f"{record['method']} {record['endpoint']} (phase {record['phase']})")
+
+    try:
+        if global_values.api_stats_format == 'openmetrics':
+            write_openmetrics(global_values.api_stats, records)
+        else:
+            write_json(global_values.api_stats, records)
+        logging.info(f"- API statistics written to {global_values.api_stats}")
+    except Exception as e:
+        logging.error(f"Unable to write API statistics file {global_values.api_stats} - {str(e)}")
+
+
+class CountingStream:
+    # Wraps the raw response to count the (decoded) body bytes read
+
+    def __init__(self, raw, key):
+        self.raw = raw
+        self.key = key
+
+    def stream(self, *args, **kwargs):
+        for chunk in self.raw.stream(*args, **kwargs):
+            add_bytes(self.key, len(chunk))
+            yield chunk
+
+    def read(self, *args, **kwargs):
+        data = self.raw.read(*args, **kwargs)
+        add_bytes(self.key, len(data))
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+def install(session):
+    for prefix, adapter in list(session.adapters.items()):
+        if not isinstance(adapter, InstrumentedAdapter):
+            session.mount(prefix, InstrumentedAdapter(adapter))
+
+
+class InstrumentedAdapter(requests.adapters.BaseAdapter):
+    # Installed as the innermost adapter so only requests sent to the server are measured
+
+    def __init__(self, adapter):
+        super().__init__()
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        start = time.monotonic()
+        try:
+            resp = self.adapter.send(request, **kwargs)
+        except Exception:
+            record(request.method, request.url, 0, time.monotonic() - start)
+            raise
+        key = record(request.method, request.url, resp.status_code, time.monotonic() - start)
+        resp.raw = CountingStream(resp.raw, key)
+        return resp
+
+    def close(self):
+        self.adapter.close()
+
+
+def get_trace_config():
+    import aiohttp
+
+    async def on_request_start(session, ctx, params):
+        ctx.start = time.monotonic()
+
+    async def on_request_end(session, ctx, params):
+        ctx.key = record(params.method, str(params.url), params.response.status, time.monotonic() - ctx.start)
+
+    async def on_request_exception(session, ctx, params):
+        record(params.method, str(params.url), 0, time.monotonic() - ctx.start)
+
+    async def on_response_chunk_received(session, ctx, params):
+        if hasattr(ctx, 'key'):
+            add_bytes(ctx.key, len(params.chunk))
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    trace_config.on_response_chunk_received.append(on_response_chunk_received)
+    return trace_config
@@ -0,0 +1,106 @@
+import time
+import atexit
+import asyncio
+import logging
+import platform
+import threading
+import aiohttp
+
+from bd_scan_yocto import global_values
+from bd_scan_yocto import ratelimit
+
+
+class AsyncClient:
+    # One aiohttp session (and keep-alive connection pool) running on a background event loop, used only for
+    # the Phase 6A matched-file lookups and Phase 7 remediation PUTs. All other API calls (including paged BOM and
+    # vulnerability reads and bulk adjustments) use the blackduck.Client requests session, which has its own
+    # connection pool and authentication. Synchronous code runs coroutines using run() or submit().
+
+    def __init__(self):
+        if platform.system() == "Windows":
+            self.loop = asyncio.SelectorEventLoop()
+        else:
+            self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='bd_async_client', daemon=True)
+        self.thread.start()
+        self.session = None
+        self.auth_lock = None
+        self.token = ''
+        self.token_expires = 0
+        # Certificate verification disabled when the server cert is trusted
+        self.ssl = False if global_values.bd_trustcert else None
+
+    def run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def submit(self, coro):
+        # Starts the coroutine immediately, returning a future for its result
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def get_session(self):
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=max(global_values.api_threads, global_values.api_max_inflight),
+                                             ssl=self.ssl, keepalive_timeout=60)
+            trace_configs = None
+            if global_values.api_stats != '':
+                from bd_scan_yocto import apistats
+                trace_configs = [apistats.get_trace_config()]
+            self.session = aiohttp.ClientSession(connector=connector, trust_env=True, trace_configs=trace_configs,
+                                                 timeout=aiohttp.ClientTimeout(total=60))
+            self.auth_lock = asyncio.Lock()
+        return self.session
+
+    async def authenticate(self, force=False):
+        # Bearer tokens are obtained from the API token and refreshed shortly before they expire
+        async with self.auth_lock:
+            if not force and self.token != '' and time.time() < self.token_expires - 60:
+                return self.token
+            headers = {
+                'Authorization': f'token {global_values.bd_api}',
+                'Accept': 'application/vnd.blackducksoftware.user-4+json',
+            }
+            url = global_values.bd_url.rstrip('/') + '/api/tokens/authenticate'
+            async with await ratelimit.arequest(self.session, 'POST', url, headers=headers) as resp:
+                resp.raise_for_status()
+                data = await resp.json(content_type=None)
+            self.token = data['bearerToken']
+            self.token_expires = time.time() + data.get('expiresInMilliseconds', 0) / 1000
+            logging.debug("Authenticated async Black Duck API session")
+            return self.token
+
+    async def request(self, method, url, headers=None, **kwargs):
+        session = await self.get_session()
+        refreshed = False
+        while True:
+            token = await self.authenticate()
+            req_headers = dict(headers) if headers is not None else {}
+            req_headers['Authorization'] = f'Bearer {token}'
+            resp = await ratelimit.arequest(session, method, url, headers=req_headers, **kwargs)
+            if resp.status != 401 or refreshed:
+                return resp
+            # Token expired or revoked on the server - authenticate again once
+            resp.release()
+            await self.authenticate(force=True)
+            refreshed = True
+
+    async def close_session(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def close(self):
+        self.run(self.close_session())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+client = None
+
+
+def get_client():
+    global client
+
+    if client is None:
+        client = AsyncClient()
+        atexit.register(client.close)
+    return client
@@ -1,67 +1,54 @@
-import aiohttp
 import asyncio
 # import platform
 # import logging
 
-from bd_scan_yocto import global_values
+from bd_scan_yocto import jsonstream
+from bd_scan_yocto import httpcache
 
 
-async def async_main(comps, token):
-    async with aiohttp.ClientSession(trust_env=True) as session:
-        data_tasks = []
-        file_tasks = []
+async def async_main(client, comps):
+    file_tasks = []
 
-        count = 0
-        for url, comp in comps.items():
-            count += 1
+    count = 0
+    for url, comp in comps.items():
+        count += 1
 
-            file_task = asyncio.ensure_future(async_get_files(session, comp, token))
-            file_tasks.append(file_task)
+        file_task = asyncio.ensure_future(async_get_files(client, comp))
+        file_tasks.append(file_task)
 
-        await asyncio.gather(*data_tasks)
-        all_files = dict(await asyncio.gather(*file_tasks))
+    all_files = dict(await asyncio.gather(*file_tasks))
 
-        await asyncio.sleep(0.250)
-        # print(f'- {count} components ')
-        #
-        # print(all_files)
+    # print(f'- {count} components ')
+    #
+    # print(all_files)
 
     return all_files
 
 
-async def async_get_files(session, comp, token):
-    if not global_values.bd_trustcert:
-        ssl = False
-    else:
-        ssl = None
-
+async def async_get_files(client, comp):
     # retfile = "NOASSERTION"
-    hrefs = comp['_meta']['links']
-
-    link = next((item for item in hrefs if item["rel"] == "matched-files"), None)
-    if link:
-        thishref = link['href'] + '?limit=1000'
+    archive_ignore = False
+    if comp.files_href != '':
+        thishref = comp.files_href + '?limit=1000'
         headers = {
-            'Authorization': f'Bearer {token}',
             'accept': "application/vnd.blackducksoftware.bill-of-materials-6+json",
         }
 
-        archive_ignore = False
-        async with session.get(thishref, headers=headers, ssl=ssl) as resp:
-            result_data = await resp.json()
-            # cfile = result_data['items']
-            # if len(cfile) > 0:
-            #     rfile = cfile[0]['filePath']['path']
-            #     for ext in ['.jar', '.ear', '.war', '.zip', '.gz', '.tar', '.xz', '.lz', '.bz2', '.7z',
-            #                 '.rar', '.rar', '.cpio', '.Z', '.lz4', '.lha', '.arj', '.rpm', '.deb', '.dmg',
-            #                 '.gz', '.whl']:
-            #         if rfile.endswith(ext):
-            #             retfile = rfile
-            for item in result_data['items']:
-                # if item['filePath']['path'] == item['filePath']['fileName']:
-                # print(item['filePath']['path'] + ':' + item['filePath']['archiveContext'])
-                if item['filePath']['compositePathContext'] != item['filePath']['path'] + '#':
-                    archive_ignore = True
-                    break
-
-    return comp['componentVersion'], archive_ignore
+        # cfile = result_data['items']
+        # if len(cfile) > 0:
+        #     rfile = cfile[0]['filePath']['path']
+        #     for ext in ['.jar', '.ear', '.war', '.zip', '.gz', '.tar', '.xz', '.lz', '.bz2', '.7z',
+        #                 '.rar', '.rar', '.cpio', '.Z', '.lz4', '.lha', '.arj', '.rpm', '.deb', '.dmg',
+        #                 '.gz', '.whl']:
+        #         if rfile.endswith(ext):
+        #             retfile = rfile
+        # Matched files are parsed as they are received, stopping at the first file within an archive
+        chunks = httpcache.aiter_chunks(client, thishref, headers)
+        async for item in jsonstream.aiter_items(chunks):
+            # if item['filePath']['path'] == item['filePath']['fileName']:
+            # print(item['filePath']['path'] + ':' + item['filePath']['archiveContext'])
+            if item['filePath']['compositePathContext'] != item['filePath']['path'] + '#':
+                archive_ignore = True
+                break
+
+    return comp.compver, archive_ignore
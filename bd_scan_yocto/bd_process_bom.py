@@ -1,38 +1,32 @@
 #!/usr/bin/env python
 
 # import argparse
-# import json
+import json
 import logging
 import sys
-# import os
+import os
+import re
 import requests
-import platform
-import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from bd_scan_yocto.bdcomponentlist import ComponentList
+from bd_scan_yocto.bdcomponentlist import ComponentList, BomComponent
 from blackduck import Client
 from bd_scan_yocto import global_values
+from bd_scan_yocto import utils
 # from bd_scan_yocto import config
-from bd_scan_yocto import bd_asyncdata
+from bd_scan_yocto import jsonstream
+from bd_scan_yocto import ratelimit
+from bd_scan_yocto import httpcache
+from bd_scan_yocto import checkpoint
 
 # logging.basicConfig(level=logging.INFO)
 
 
 def check_projver(bd, proj, ver):
-	params = {
-		'q': "name:" + proj,
-		'sort': 'name',
-	}
-
-	projects = bd.get_resource('projects', params=params)
-	for p in projects:
-		if p['name'] == proj:
-			versions = bd.get_resource('versions', parent=p, params=params)
-			for v in versions:
-				if v['versionName'] == ver:
-					return p, v
-			break
-	else:
+	p, v = utils.resolve_projver(bd, proj, ver)
+	if v is not None:
+		return p, v
+	if p is not None:
 		logging.error(f"Version '{ver}' does not exist in project '{proj}'")
 		sys.exit(2)
 
@@ -51,33 +45,29 @@ def get_bom_components(bd, ver_dict):
 	blocksize = 1000
 
 	projver = res['href']
-	thishref = projver + f"/components?limit={blocksize}"
 	headers = {
 		'accept': "application/vnd.blackducksoftware.bill-of-materials-6+json",
 	}
-	res = bd.get_json(thishref, headers=headers)
-	if 'totalCount' in res and 'items' in res:
-		total_comps = res['totalCount']
-	else:
-		return comp_dict
 
 	downloaded_comps = 0
+	total_comps = 1
 	while downloaded_comps < total_comps:
-		downloaded_comps += len(res['items'])
-
-		bom_comps = res['items']
-
-		for comp in bom_comps:
+		thishref = projver + f"/components?limit={blocksize}&offset={downloaded_comps}"
+		fields = {}
+		page_comps = 0
+		# Components are converted one at a time as they are parsed from the response stream
+		for comp in jsonstream.iter_items(bd, thishref, headers=headers, fields=fields):
+			page_comps += 1
 			if 'componentVersion' not in comp:
 				continue
 			compver = comp['componentVersion']
 
-			comp_dict[compver] = comp
+			comp_dict[compver] = BomComponent(comp)
 
-		thishref = projver + f"/components?limit={blocksize}&offset={downloaded_comps}"
-		res = bd.get_json(thishref, headers=headers)
-		if 'totalCount' not in res or 'items' not in res:
+		if 'totalCount' not in fields or page_comps == 0:
 			break
+		total_comps = fields['totalCount']
+		downloaded_comps += page_comps
 
 	return comp_dict
 
@@ -92,21 +82,43 @@ def get_all_projects(bd):
 
 
 def process_bdproject(bdproj, bdver):
-	bd = Client(
-		token=global_values.bd_api,
-		base_url=global_values.bd_url,
-		verify=(not global_values.bd_trustcert),  # TLS certificate verification
-		timeout=60
-	)
+	# Reuse the authenticated session from the initial connection when available
+	bd = global_values.bd
+	if bd is None:
+		bd = Client(
+			token=global_values.bd_api,
+			base_url=global_values.bd_url,
+			verify=(not global_values.bd_trustcert),  # TLS certificate verification
+			timeout=60
+		)
+		if global_values.api_stats != '':
+			from bd_scan_yocto import apistats
+			apistats.install(bd.session)
+		ratelimit.install(bd.session)
+		if global_values.http_cache:
+			httpcache.install(bd.session)
 
 	proj_dict, ver_dict = check_projver(bd, bdproj, bdver)
 
-	bom_components = get_bom_components(bd, ver_dict)
+	if checkpoint.is_done('ignore'):
+		logging.info("Ignoring components completed in resumed run - skipping ...")
+		return
+
+	if checkpoint.is_done('bom'):
+		logging.info("Reusing BOM snapshot from resumed run ...")
+		bom_components = {compver: BomComponent.from_record(record)
+						  for compver, record in checkpoint.get('bom')['components'].items()}
+	else:
+		bom_components = get_bom_components(bd, ver_dict)
+		checkpoint.complete('bom', {'components': {compver: comp.as_record()
+												   for compver, comp in bom_components.items()}})
 
-	process_bom(bd, bom_components)
+	componentlist = process_bom(bd, bom_components)
 
 	if global_values.ignore_components or global_values.detect_fix:
-		ignore_components(bd, ver_dict)
+		if not ignore_components(bd, ver_dict, bom_components, componentlist):
+			return
+	checkpoint.complete('ignore')
 	return
 
 
@@ -125,81 +137,163 @@ def process_bom(bd, bom_components):
 	# logging.info(f"Black Duck Server = {global_values.bd_url}")
 	logging.info(f"- Total Components {all_comp_count} - Already Ignored Components {ignored_comps}")
 
-	return
+	return componentlist
 
 
-def ignore_components(bd, ver_dict):
-	logging.info('----------------------------------   PHASE 6A  ----------------------------------')
-	logging.info("Ignoring partially matched compoents  ...")
+def get_decision_key(comp):
+	return f"{comp.compver}|{','.join(sorted(comp.match_types))}"
 
-	# print('Getting components from project ... found ', end='')
-	bom_compsdict = get_bom_components(bd, ver_dict)
-	# print("{}".format(str(len(bom_compsdict))))
 
-	logging.info('- Getting component data ... ')
+def get_decisions_file():
+	return os.path.join(global_values.cache_dir, 'ignore_decisions',
+						re.sub('[^\\w.-]', '_', global_values.bd_project) + '.json')
 
-	if platform.system() == "Windows":
-		asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-	pkg_ignore_dict = asyncio.run(bd_asyncdata.async_main(bom_compsdict, bd.session.auth.bearer_token))
 
-	ignore_comps = []
-	count_ignored = 0
-	ignore_array = []
+def load_ignore_decisions():
+	decisions_file = get_decisions_file()
+	if not global_values.ignore_cache or not os.path.isfile(decisions_file):
+		return {}
+	try:
+		with open(decisions_file, 'r') as f:
+			return json.load(f)
+	except Exception as e:
+		logging.warning(f"Unable to read ignore decisions file {decisions_file} - {str(e)}")
+		return {}
 
-	logging.info("- Ignoring partial components ...")
-	count = 0
+
+def save_ignore_decisions(decisions):
+	if not global_values.ignore_cache:
+		return
+	decisions_file = get_decisions_file()
+	try:
+		if not os.path.isdir(os.path.dirname(decisions_file)):
+			os.makedirs(os.path.dirname(decisions_file))
+		with open(decisions_file + '.tmp', 'w') as f:
+			json.dump(decisions, f)
+		os.replace(decisions_file + '.tmp', decisions_file)
+	except Exception as e:
+		logging.warning(f"Unable to write ignore decisions file {decisions_file} - {str(e)}")
+
+
+def ignore_components(bd, ver_dict, bom_compsdict, componentlist):
+	logging.info('----------------------------------   PHASE 6A  ----------------------------------')
+	global_values.api_phase = '6A'
+	logging.info("Ignoring partially matched compoents  ...")
+
+	ignore_list = []
+	fetch_compsdict = {}
+	pkg_ignore_dict = {}
+	decisions = load_ignore_decisions()
 	for comp in bom_compsdict.keys():
-		ignored = False
+		# Skip components already ignored in the BOM
+		if componentlist.is_ignored(comp):
+			continue
+		bom_comp = bom_compsdict[comp]
+		compname = f"{bom_comp.name}/{bom_comp.version}"
 		if global_values.detect_fix:
 			exists_in_manifest = False
-			vername = bom_compsdict[comp]['componentVersionName']
-			if (len(bom_compsdict[comp]['matchTypes']) == 1 and
-					bom_compsdict[comp]['matchTypes'][0] == 'FILE_DEPENDENCY_DIRECT'):
-				extid = bom_compsdict[comp]['origins'][0]['externalId']
-				compname = extid.split('/')[1]
-				if compname in global_values.recipes_dict.keys():
-					if vername == global_values.recipes_dict[compname]:
+			vername = bom_comp.version
+			if len(bom_comp.match_types) == 1 and bom_comp.match_types[0] == 'FILE_DEPENDENCY_DIRECT':
+				arr = bom_comp.extid.split('/')
+				recipe = arr[1] if len(arr) > 1 else ''
+				if recipe in global_values.recipes_dict.keys():
+					if vername == global_values.recipes_dict[recipe]:
 						# Exists in license_manifest
 						exists_in_manifest = True
 				if not exists_in_manifest:
-					ignore_array.append(bom_compsdict[comp]['_meta']['href'])
-					count_ignored += 1
-					count += 1
-					ignored = True
-		if global_values.ignore_components and not ignored and pkg_ignore_dict[comp]:
+					ignore_list.append((bom_comp.href, compname, 'not in license.manifest'))
+					continue
+		if global_values.ignore_components:
+			key = get_decision_key(bom_compsdict[comp])
+			if key in decisions.keys():
+				pkg_ignore_dict[comp] = decisions[key]
+			else:
+				fetch_compsdict[comp] = bom_compsdict[comp]
+
+	# Only get matched files for components where the outcome is not already known
+	logging.info(f"- Getting component data for {len(fetch_compsdict)} components "
+				 f"({len(pkg_ignore_dict)} decisions reused from previous runs) ... ")
+	if len(fetch_compsdict) > 0:
+		# The async stack is only needed when matched files have to be downloaded
+		from bd_scan_yocto import asyncclient
+		from bd_scan_yocto import bd_asyncdata
+
+		client = asyncclient.get_client()
+		fetch_ignore_dict = client.run(bd_asyncdata.async_main(client, fetch_compsdict))
+		for comp, archive_ignore in fetch_ignore_dict.items():
+			pkg_ignore_dict[comp] = archive_ignore
+			decisions[get_decision_key(bom_compsdict[comp])] = archive_ignore
+		save_ignore_decisions(decisions)
+
+	logging.info("- Ignoring partial components ...")
+	for comp in pkg_ignore_dict.keys():
+		if pkg_ignore_dict[comp]:
 			# Ignore this component
-			ignore_array.append(bom_compsdict[comp]['_meta']['href'])
-			count_ignored += 1
-			count += 1
-			ignored = True
-		if ignored and count_ignored >= 99:
-			ignore_comps.append(ignore_array)
-			ignore_array = []
-			count_ignored = 0
-
-	ignore_comps.append(ignore_array)
-	if count == 0:
+			compname = f"{bom_compsdict[comp].name}/{bom_compsdict[comp].version}"
+			ignore_list.append((bom_compsdict[comp].href, compname, 'matched within archive'))
+
+	if len(ignore_list) == 0:
+		return True
+
+	url = ver_dict['_meta']['href'] + '/bulk-adjustment'
+	batch_size = global_values.ignore_batch_size
+	batches = [ignore_list[i:i + batch_size] for i in range(0, len(ignore_list), batch_size)]
+	ignored_list = []
+	failed_list = []
+	with ThreadPoolExecutor(max_workers=global_values.api_threads) as executor:
+		futures = [executor.submit(submit_bulk_ignore, bd, url, batch) for batch in batches]
+		for future in as_completed(futures):
+			batch, ok = future.result()
+			if ok:
+				ignored_list += batch
+			else:
+				failed_list += batch
+			logging.debug(f"- Processed {len(ignored_list) + len(failed_list)}/{len(ignore_list)} components")
+
+	for href, compname, reason in ignored_list:
+		logging.info(f"- Ignored component {compname} ({reason})")
+	for href, compname, reason in failed_list:
+		logging.error(f"- Unable to ignore component {compname} ({reason})")
+
+	if global_values.ignore_report != '':
+		write_ignore_report(global_values.ignore_report, ignored_list, failed_list)
+
+	logging.info(f"- Ignored {len(ignored_list)} components")
+	return len(failed_list) == 0
+
+
+def submit_bulk_ignore(bd, url, batch):
+	bulk_data = {
+		"components": [href for href, compname, reason in batch],
+		# "reviewStatus": "REVIEWED",
+		"ignored": True,
+		# "usage": "DYNAMICALLY_LINKED",
+		# "inAttributionReport": true
+	}
+	headers = {
+		"Accept": "application/vnd.blackducksoftware.bill-of-materials-6+json",
+		"Content-Type": "application/vnd.blackducksoftware.bill-of-materials-6+json"
+	}
+
+	# Throttled requests are retried by the session adapters (see ratelimit)
+	try:
+		r = bd.session.patch(url, json=bulk_data, headers=headers)
+		r.raise_for_status()
+	except requests.RequestException as err:
+		logging.error(f"Unable to ignore {len(batch)} components - {str(err)}")
+		return batch, False
+	return batch, True
+
+
+def write_ignore_report(report_file, ignored_list, failed_list):
+	report = {
+		'ignored': [{'component': compname, 'href': href, 'reason': reason} for href, compname, reason in ignored_list],
+		'failed': [{'component': compname, 'href': href, 'reason': reason} for href, compname, reason in failed_list],
+	}
+	try:
+		with open(report_file, 'w') as f:
+			json.dump(report, f, indent=4)
+	except Exception as e:
+		logging.error(f"Unable to write ignore report file {report_file}\n" + str(e))
 		return
-	for ignore_array in ignore_comps:
-		if ignore_array:
-			bulk_data = {
-				"components": ignore_array,
-				# "reviewStatus": "REVIEWED",
-				"ignored": True,
-				# "usage": "DYNAMICALLY_LINKED",
-				# "inAttributionReport": true
-			}
-
-			try:
-				url = ver_dict['_meta']['href'] + '/bulk-adjustment'
-				headers = {
-					"Accept": "application/vnd.blackducksoftware.bill-of-materials-6+json",
-					"Content-Type": "application/vnd.blackducksoftware.bill-of-materials-6+json"
-				}
-				r = bd.session.patch(url, json=bulk_data, headers=headers)
-				r.raise_for_status()
-			except requests.HTTPError as err:
-				bd.http_error_handler(err)
-
-	logging.info(f"- Ignored {count} components")
-	return
+	logging.info(f"- Ignored components report written to {report_file}")
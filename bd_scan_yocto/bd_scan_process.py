@@ -1,4 +1,3 @@
-import requests
 import os
 # import subprocess
 import sys
@@ -25,6 +24,7 @@ def get_detect():
             sys.exit(2)
         shpath = os.path.join(tdir, 'detect9.sh')
 
+        import requests
         j = requests.get("https://detect.synopsys.com/detect9.sh")
         if j.ok:
             open(shpath, 'wb').write(j.content)
@@ -40,9 +40,17 @@ def get_detect():
     return cmd
 
 
-def run_detect_sigscan(tdir, proj, ver, trust):
+def run_detect_sigscan(tdir, proj, ver, trust, codelocation='', keep=False, snippets=None, binary=None):
     import shutil
 
+    if snippets is None:
+        snippets = global_values.snippets
+    if binary is None:
+        binary = global_values.binary_scan
+    if global_values.binary_cache:
+        # Binary package files are uploaded separately by bincache
+        binary = False
+
     cmd = get_detect()
 
     detect_cmd = cmd
@@ -52,13 +60,15 @@ def run_detect_sigscan(tdir, proj, ver, trust):
     detect_cmd += f"--blackduck.api.token={global_values.bd_api} "
     if trust:
         detect_cmd += "--blackduck.trust.cert=true "
+    if codelocation != '':
+        detect_cmd += f"--detect.code.location.name='{codelocation}' "
     detect_cmd += "--detect.wait.for.results=true "
-    if global_values.snippets:
+    if snippets:
         detect_cmd += "--detect.blackduck.signature.scanner.snippet.matching=SNIPPET_MATCHING "
     if not 'detect.timeout' in global_values.detect_opts:
         detect_cmd += "--detect.timeout=1200 "
 
-    if global_values.binary_scan:
+    if binary:
         detect_cmd += f"--detect.binary.scan.file.name.patterns='{global_values.binary_scan_exts}' "
 
     if global_values.detect_opts != '':
@@ -70,7 +80,7 @@ def run_detect_sigscan(tdir, proj, ver, trust):
     # mystr = output.decode("utf-8").strip()
     # lines = mystr.splitlines()
     retval = os.system(detect_cmd)
-    if not global_values.testmode:
+    if not global_values.testmode and not keep:
         shutil.rmtree(tdir)
 
     if retval != 0:
@@ -82,6 +92,57 @@ def run_detect_sigscan(tdir, proj, ver, trust):
     return
 
 
+def run_detect_dryrun_sigscan(cmd, tdir, outdir, proj, ver):
+    detect_cmd = cmd
+    detect_cmd += f" --detect.source.path='{tdir}' --detect.project.name='{proj}' " + \
+                  f"--detect.project.version.name='{ver}' "
+    detect_cmd += f"--blackduck.url={global_values.bd_url} "
+    detect_cmd += f"--blackduck.api.token={global_values.bd_api} "
+    if global_values.bd_trustcert:
+        detect_cmd += "--blackduck.trust.cert=true "
+    detect_cmd += "--detect.tools=SIGNATURE_SCAN "
+    detect_cmd += "--detect.blackduck.signature.scanner.dry.run=true "
+    detect_cmd += f"--detect.output.path='{outdir}' "
+    if global_values.snippets:
+        detect_cmd += "--detect.blackduck.signature.scanner.snippet.matching=SNIPPET_MATCHING "
+    if global_values.detect_opts != '':
+        detect_cmd += global_values.detect_opts
+
+    logging.debug(f"Detect dry run Sigscan cmd '{detect_cmd}'")
+    retval = os.system(detect_cmd)
+    if retval != 0:
+        logging.error(f"Unable to run Detect Signature scan on {tdir}")
+        return False
+
+    return True
+
+
+def run_detect_binscan(cmd, binfile, proj, ver, codelocation, outdir):
+    detect_cmd = cmd
+    detect_cmd += f" --detect.binary.scan.file.path='{binfile}' --detect.project.name='{proj}' " + \
+                  f"--detect.project.version.name='{ver}' "
+    detect_cmd += f"--blackduck.url={global_values.bd_url} "
+    detect_cmd += f"--blackduck.api.token={global_values.bd_api} "
+    if global_values.bd_trustcert:
+        detect_cmd += "--blackduck.trust.cert=true "
+    detect_cmd += "--detect.tools=BINARY_SCAN "
+    detect_cmd += f"--detect.code.location.name='{codelocation}' "
+    detect_cmd += f"--detect.output.path='{outdir}' "
+    detect_cmd += "--detect.wait.for.results=true "
+    if not 'detect.timeout' in global_values.detect_opts:
+        detect_cmd += "--detect.timeout=1200 "
+    if global_values.detect_opts != '':
+        detect_cmd += global_values.detect_opts
+
+    logging.debug(f"Detect Binary scan cmd '{detect_cmd}'")
+    retval = os.system(detect_cmd)
+    if retval != 0:
+        logging.error(f"Unable to run Detect Binary scan on {binfile}")
+        return False
+
+    return True
+
+
 def run_detect_for_bitbake():
     cmd = get_detect()
 
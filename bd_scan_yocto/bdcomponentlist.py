@@ -3,6 +3,40 @@ import logging
 # from copyrightmanager import CopyrightManager
 
 
+class BomComponent:
+    # Only the fields required from the BOM component JSON are retained
+    __slots__ = ('name', 'version', 'compver', 'href', 'match_types', 'extid', 'ignored', 'files_href')
+
+    def __init__(self, comp):
+        self.name = comp.get('componentName', '')
+        self.version = comp.get('componentVersionName')
+        self.compver = comp.get('componentVersion', '')
+        self.href = comp['_meta']['href']
+        self.match_types = tuple(comp.get('matchTypes', []))
+        origins = comp.get('origins', [])
+        if len(origins) > 0 and 'externalId' in origins[0]:
+            self.extid = origins[0]['externalId']
+        else:
+            self.extid = ''
+        self.ignored = comp.get('ignored', False)
+        link = next((item for item in comp['_meta']['links'] if item["rel"] == "matched-files"), None)
+        if link:
+            self.files_href = link['href']
+        else:
+            self.files_href = ''
+
+    @classmethod
+    def from_record(cls, record):
+        comp = cls.__new__(cls)
+        for field in cls.__slots__:
+            setattr(comp, field, record[field])
+        comp.match_types = tuple(comp.match_types)
+        return comp
+
+    def as_record(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+
 class ComponentList:
     # components_dict = {}
 
@@ -13,8 +47,11 @@ class ComponentList:
     def add(self, compname, copyrightmgr):
         self.components_dict[compname] = copyrightmgr
 
-    def add_ignored(self, compname):
-        self.ignored_components[compname] = 1
+    def add_ignored(self, compurl):
+        self.ignored_components[compurl] = 1
+
+    def is_ignored(self, compurl):
+        return compurl in self.ignored_components
 
     def count_comps(self):
         return len(self.components_dict)
@@ -45,16 +82,16 @@ class ComponentList:
         logging.info("Processing BOM components ...")
         for compurl, bom_component in bom_components.items():
 
-            if 'componentVersionName' in bom_component:
-                bom_component_name = f"{bom_component['componentName']}:{bom_component['componentVersionName']}"
+            if bom_component.version is not None:
+                bom_component_name = f"{bom_component.name}:{bom_component.version}"
             else:
-                bom_component_name = f"{bom_component['componentName']}"
+                bom_component_name = f"{bom_component.name}"
                 logging.warning(f"Component found with no version: {bom_component_name}")
                 continue
 
-            if bom_component['ignored']:
+            if bom_component.ignored:
                 logging.info(f"Skipping Ignored Component: {bom_component_name}")
-                self.add_ignored(bom_component_name)
+                self.add_ignored(compurl)
                 continue
             else:
                 logging.info(f"Processing Component: {bom_component_name}")
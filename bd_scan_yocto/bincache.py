@@ -0,0 +1,92 @@
+import os
+import sys
+import fnmatch
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from bd_scan_yocto import global_values
+from bd_scan_yocto import bd_scan_process
+from bd_scan_yocto import sigcache
+from bd_scan_yocto import utils
+
+# Binary scans use one code location per package content hash
+codelocation_prefix = 'bd_scan_yocto/binary/'
+
+
+def is_binary_pkg(path):
+    if not os.path.isfile(path):
+        return False
+    name = os.path.basename(path)
+    return any(fnmatch.fnmatch(name, pattern.strip()) for pattern in global_values.binary_scan_exts.split(','))
+
+
+def get_codelocation_name(proj, ver, phash):
+    return f"{proj}/{ver}/{codelocation_prefix}{phash[:16]}"
+
+
+def get_binary_codelocations(bd, proj, ver):
+    bdproj, bdver = utils.resolve_projver(bd, proj, ver)
+    if bdver is None:
+        return {}
+    prefix = f"{proj}/{ver}/{codelocation_prefix}"
+    return {cl['name']: cl for cl in bd.get_resource('codelocations', parent=bdver) if cl['name'].startswith(prefix)}
+
+
+def scan_pkg(cmd, pkg, proj, ver, name):
+    import shutil
+    import tempfile
+
+    logging.info(f"- Binary scanning {pkg} ...")
+    # Each Detect run uses its own output folder as they run concurrently
+    outdir = tempfile.mkdtemp(prefix="bd_bin_out")
+    try:
+        return bd_scan_process.run_detect_binscan(cmd, pkg, proj, ver, name, outdir)
+    finally:
+        if not global_values.testmode:
+            shutil.rmtree(outdir, ignore_errors=True)
+
+
+def run_binary_scans(bd, pkgs, proj, ver):
+    index = sigcache.load_hash_index()
+    hashes = {}
+    for pkg in pkgs:
+        if is_binary_pkg(pkg):
+            # Identical package files are only scanned once
+            hashes.setdefault(sigcache.get_file_hash(index, pkg), pkg)
+    sigcache.save_hash_index(index)
+
+    existing = get_binary_codelocations(bd, proj, ver)
+    reused_count = 0
+    names = []
+    scan_list = []
+    for phash, pkg in hashes.items():
+        name = get_codelocation_name(proj, ver, phash)
+        names.append(name)
+        if name in existing.keys():
+            logging.debug(f"- Reusing binary scan {name} for {pkg}")
+            reused_count += 1
+        else:
+            scan_list.append((pkg, name))
+
+    # Changed packages are uploaded by concurrent Detect runs so the BDBA waits overlap
+    scanned_count = 0
+    scanned_size = 0
+    failed = False
+    if len(scan_list) > 0:
+        cmd = bd_scan_process.get_detect()
+        with ThreadPoolExecutor(max_workers=global_values.binary_scan_threads) as executor:
+            futures = {executor.submit(scan_pkg, cmd, pkg, proj, ver, name): pkg for pkg, name in scan_list}
+            for future in as_completed(futures):
+                if future.result():
+                    scanned_count += 1
+                    scanned_size += os.path.getsize(futures[future])
+                else:
+                    failed = True
+
+    # Remove binary scans for packages which are no longer in the build so they do not remain in the BOM
+    removed_count = utils.remove_codelocations(bd, proj, ver, f"{proj}/{ver}/{codelocation_prefix}", names)
+
+    logging.info(f"- Reused {reused_count} binary scans, uploaded {scanned_count} changed package files "
+                 f"({scanned_size / (1024 * 1024):.1f} MB), removed {removed_count} obsolete binary scans")
+    if failed:
+        sys.exit(2)
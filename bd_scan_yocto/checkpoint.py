@@ -0,0 +1,86 @@
+import os
+import json
+import time
+import logging
+import threading
+
+from bd_scan_yocto import global_values
+
+# Phases with saved outputs in the run folder, in processing order
+PHASES = ['recipes', 'bitbake', 'pkgfiles', 'sigscan', 'bom', 'ignore', 'cves']
+
+state = {}
+state_lock = threading.Lock()
+
+
+def enabled():
+    return global_values.run_dir != ''
+
+
+def get_state_file():
+    return os.path.join(global_values.run_dir, 'state.json')
+
+
+def init(resume):
+    global state
+
+    if not os.path.isdir(global_values.run_dir):
+        os.makedirs(global_values.run_dir)
+    state = {
+        'project': global_values.bd_project,
+        'version': global_values.bd_version,
+        'started': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'phases': {},
+    }
+    if not resume:
+        save()
+        logging.info(f"Saving phase outputs to run folder {global_values.run_dir}")
+        return True
+
+    try:
+        with open(get_state_file(), 'r') as f:
+            saved = json.load(f)
+    except Exception as e:
+        logging.error(f"Unable to read run state file {get_state_file()} - {str(e)}")
+        return False
+    if saved.get('project') != global_values.bd_project or saved.get('version') != global_values.bd_version:
+        logging.error(f"Run folder {global_values.run_dir} is for project '{saved.get('project')}' version "
+                      f"'{saved.get('version')}' - cannot resume")
+        return False
+    state = saved
+    done = [phase for phase in PHASES if phase in state['phases'] and state['phases'][phase].get('complete')]
+    logging.info(f"Resuming run from {global_values.run_dir} - completed phases: "
+                 f"{', '.join(done) if len(done) > 0 else 'none'}")
+    return True
+
+
+def save():
+    statefile = get_state_file()
+    with open(statefile + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(statefile + '.tmp', statefile)
+
+
+def is_done(phase):
+    return enabled() and state['phases'].get(phase, {}).get('complete', False)
+
+
+def get(phase):
+    if not enabled():
+        return {}
+    return state['phases'].get(phase, {})
+
+
+def update(phase, data, complete=False):
+    # Phase outputs may be recorded from the background Bitbake scan thread
+    if not enabled():
+        return
+    with state_lock:
+        entry = state['phases'].setdefault(phase, {})
+        entry.update(data)
+        entry['complete'] = complete
+        save()
+
+
+def complete(phase, data=None):
+    update(phase, data if data is not None else {}, True)
@@ -1,4 +1,5 @@
 import os
+import atexit
 import argparse
 import shutil
 import sys
@@ -8,81 +9,156 @@ import re
 # import tempfile
 import logging
 
-from blackduck import Client
 from bd_scan_yocto import global_values
 from bd_scan_yocto import utils
 
-parser = argparse.ArgumentParser(description='Black Duck scan Yocto project',
-                                 prog='bd_scan_yocto')
-
-# parser.add_argument("projfolder", nargs="?", help="Yocto project folder to analyse", default=".")
-
-parser.add_argument("--blackduck_url", type=str, help="Black Duck server URL (REQUIRED)", default="")
-parser.add_argument("--blackduck_api_token", type=str, help="Black Duck API token (REQUIRED)", default="")
-parser.add_argument("--blackduck_trust_cert", help="Black Duck trust server cert", action='store_true')
-parser.add_argument("--detect-jar-path", help="Synopsys Detect jar path", default="")
-parser.add_argument("-p", "--project", help="Black Duck project to create (REQUIRED)", default="")
-parser.add_argument("-v", "--version", help="Black Duck project version to create (REQUIRED)", default="")
-parser.add_argument("--oe_build_env",
-                    help="Yocto build environment config file (default 'oe-init-build-env')",
-                    default="oe-init-build-env")
-parser.add_argument("-t", "--target", help="Yocto target (e.g. core-image-sato - REQUIRED)",
-                    default="")
-parser.add_argument("--build_dir", type=str, help="Alternative build folder", default="")
-parser.add_argument("-m", "--manifest",
-                    help="Built license.manifest file (usually under ",
-                    default="")
-parser.add_argument("--machine", help="Machine Architecture (for example 'qemux86_64' - usually extracted"
-                                      "from Bitbake environment)",
-                    default="")
-parser.add_argument("--skip_detect_for_bitbake", help="Skip running Detect for Bitbake dependencies",
-                    action='store_true')
-parser.add_argument("--detect_opts", help="Additional Synopsys Detect options", default="")
-parser.add_argument("--cve_check_only", help="Only check for patched CVEs from cve_check and update existing project "
-                                             "(skipping scans)",
-                    action='store_true')
-parser.add_argument("--no_cve_check", help="Skip checking/updating patched CVEs", action='store_true')
-parser.add_argument("--cve_check_file",
-                    help="CVE check output file (if not specified will be determined from environment)", default="")
-# parser.add_argument("--wizard", help="Start command line wizard (Wizard will run by default if config incomplete)",
-#                     action='store_true')
-# parser.add_argument("--nowizard", help="Do not use wizard (command line batch only)", action='store_true')
-parser.add_argument("--extended_scan_layers",
-                    help="Specify a comma-delimited list of layers where packages within recipes will be expanded "
-                         "and Snippet scanned",
-                    default="")
-parser.add_argument("--snippets", help="Run snippet scan for downloaded package files",
-                    action='store_true')
-parser.add_argument("--exclude_layers",
-                    help="Specify a command-delimited list of layers where packages within recipes will not be "
-                         "Signature scanned", default="")
-parser.add_argument("--download_dir",
-                    help="Download directory where original OSS source is downloaded (usually poky/build/downloads)",
-                    default="")
-parser.add_argument("--package_dir",
-                    help="Download directory where package files are downloaded "
-                         "(for example poky/build/tmp/deploy/rpm/<ARCH>)",
-                    default="")
-parser.add_argument("--image_package_type",
-                    help="Package type used for installing packages (e.g. rpm, deb or ipx)",
-                    default="rpm")
-parser.add_argument("--no_ignore", help="Do not ignore partial components after Signature matching",
-                    action='store_true')
-parser.add_argument("--binary_scan", help="Run BDBA binary scan on packages (requires BDBA license)",
-                    action='store_true')
-parser.add_argument("--no_init_script", help="Bypass using the OE init script taking environment from"
-                                             "current shell (requires --skip_detect_for_bitbake to be specified)",
-                    action='store_true')
-parser.add_argument("--detect_fix", help="Process license_manifest to ignore build dependencies "
-                    "(required where Detect option --detect.bitbake.dependency.types.excluded=BUILD is not operating "
-                                         "correctly)",
-                    action='store_true')
-parser.add_argument("--testmode", help="Test mode - skip various checks", action='store_true')
-parser.add_argument("--debug", help="Debug logging mode", action='store_true')
-parser.add_argument("--logfile", help="Logging output file", default="")
-parser.add_argument("--no_unmap", help="Do not unmap previous scans when running new scan", action='store_true')
-
-args = parser.parse_args()
+
+# The parser is only built when the arguments are parsed to keep imports of this module fast
+def get_parser():
+    parser = argparse.ArgumentParser(description='Black Duck scan Yocto project',
+                                     prog='bd_scan_yocto')
+
+    # parser.add_argument("projfolder", nargs="?", help="Yocto project folder to analyse", default=".")
+
+    parser.add_argument("--blackduck_url", type=str, help="Black Duck server URL (REQUIRED)", default="")
+    parser.add_argument("--blackduck_api_token", type=str, help="Black Duck API token (REQUIRED)", default="")
+    parser.add_argument("--blackduck_trust_cert", help="Black Duck trust server cert", action='store_true')
+    parser.add_argument("--detect-jar-path", help="Synopsys Detect jar path", default="")
+    parser.add_argument("-p", "--project", help="Black Duck project to create (REQUIRED)", default="")
+    parser.add_argument("-v", "--version", help="Black Duck project version to create (REQUIRED)", default="")
+    parser.add_argument("--oe_build_env",
+                        help="Yocto build environment config file (default 'oe-init-build-env')",
+                        default="oe-init-build-env")
+    parser.add_argument("-t", "--target", help="Yocto target (e.g. core-image-sato - REQUIRED)",
+                        default="")
+    parser.add_argument("--build_dir", type=str, help="Alternative build folder", default="")
+    parser.add_argument("-m", "--manifest",
+                        help="Built license.manifest file (usually under ",
+                        default="")
+    parser.add_argument("--machine", help="Machine Architecture (for example 'qemux86_64' - usually extracted"
+                                          "from Bitbake environment)",
+                        default="")
+    parser.add_argument("--skip_detect_for_bitbake", help="Skip running Detect for Bitbake dependencies",
+                        action='store_true')
+    parser.add_argument("--detect_opts", help="Additional Synopsys Detect options", default="")
+    parser.add_argument("--cve_check_only", help="Only check for patched CVEs from cve_check and update existing project "
+                                                 "(skipping scans)",
+                        action='store_true')
+    parser.add_argument("--no_cve_check", help="Skip checking/updating patched CVEs", action='store_true')
+    parser.add_argument("--cve_check_file",
+                        help="CVE check output file (if not specified will be determined from environment)", default="")
+    # parser.add_argument("--wizard", help="Start command line wizard (Wizard will run by default if config incomplete)",
+    #                     action='store_true')
+    # parser.add_argument("--nowizard", help="Do not use wizard (command line batch only)", action='store_true')
+    parser.add_argument("--extended_scan_layers",
+                        help="Specify a comma-delimited list of layers where packages within recipes will be expanded "
+                             "and Snippet scanned",
+                        default="")
+    parser.add_argument("--snippets", help="Run snippet scan for downloaded package files",
+                        action='store_true')
+    parser.add_argument("--use_workdir", help="Stage the unpacked and patched recipe sources from the build work "
+                                              "folder instead of extracting package files for --extended_scan_layers",
+                        action='store_true')
+    parser.add_argument("--layer_profiles",
+                        help="Specify a comma-delimited list of layer=modes scan profiles (modes signature, snippets "
+                             "and binary joined with '+', e.g. meta-company=snippets+binary) - recipes in each profile "
+                             "are scanned separately", default="")
+    parser.add_argument("--exclude_layers",
+                        help="Specify a command-delimited list of layers where packages within recipes will not be "
+                             "Signature scanned", default="")
+    parser.add_argument("--download_dir",
+                        help="Download directory where original OSS source is downloaded (usually poky/build/downloads)",
+                        default="")
+    parser.add_argument("--package_dir",
+                        help="Download directory where package files are downloaded "
+                             "(for example poky/build/tmp/deploy/rpm/<ARCH>)",
+                        default="")
+    parser.add_argument("--image_package_type",
+                        help="Package type used for installing packages (e.g. rpm, deb or ipx)",
+                        default="rpm")
+    parser.add_argument("--no_ignore", help="Do not ignore partial components after Signature matching",
+                        action='store_true')
+    parser.add_argument("--binary_scan", help="Run BDBA binary scan on packages (requires BDBA license)",
+                        action='store_true')
+    parser.add_argument("--no_binary_cache", help="Upload all package files for binary scan instead of only "
+                                                  "packages with new content", action='store_true')
+    parser.add_argument("--binary_scan_threads", help="Number of concurrent Detect runs used to upload changed package "
+                                                      "files for binary scan (default 4)", type=int, default=4)
+    parser.add_argument("--no_init_script", help="Bypass using the OE init script taking environment from"
+                                                 "current shell (requires --skip_detect_for_bitbake to be specified)",
+                        action='store_true')
+    parser.add_argument("--detect_fix", help="Process license_manifest to ignore build dependencies "
+                        "(required where Detect option --detect.bitbake.dependency.types.excluded=BUILD is not operating "
+                                             "correctly)",
+                        action='store_true')
+    parser.add_argument("--testmode", help="Test mode - skip various checks", action='store_true')
+    parser.add_argument("--debug", help="Debug logging mode", action='store_true')
+    parser.add_argument("--logfile", help="Logging output file", default="")
+    parser.add_argument("--no_unmap", help="Do not unmap previous scans when running new scan", action='store_true')
+    parser.add_argument("--cache_dir", help="Folder used to store local caches (default $HOME/.bd_scan_yocto)",
+                        default="")
+    parser.add_argument("--sigscan_cache", help="Signature scan each package separately and cache the scan results by "
+                                                "package file hash, only rescanning changed packages",
+                        action='store_true')
+    parser.add_argument("--extract_profile", help="Files to keep when expanding archives for --extended_scan_layers - "
+                                                  "'source' (source and license files only - default) or 'all'",
+                        choices=['source', 'all'], default="source")
+    parser.add_argument("--extract_include_exts", help="Comma-delimited list of additional file extensions to keep when "
+                                                       "expanding archives (e.g. '.txt,.json')", default="")
+    parser.add_argument("--extract_exclude_exts", help="Comma-delimited list of file extensions to skip when expanding "
+                                                       "archives", default="")
+    parser.add_argument("--extract_exclude_paths", help="Comma-delimited list of path globs to skip when expanding "
+                                                        "archives (e.g. '*/tests/*')", default="")
+    parser.add_argument("--extract_max_file_size", help="Skip files larger than this size (KB) when expanding archives",
+                        type=int, default=0)
+    parser.add_argument("--max_stage_size", help="Maximum disk space (MB) used to stage package files - packages are "
+                                                 "staged and scanned in multiple waves within this limit",
+                        type=int, default=0)
+    parser.add_argument("--staging_dir", help="Persistent folder used to stage package files for Signature scanning - "
+                                              "only changed package files are restaged on subsequent runs",
+                        default="")
+    parser.add_argument("--api_threads", help="Number of concurrent Black Duck API requests (default 4)",
+                        type=int, default=4)
+    parser.add_argument("--api_rate", help="Maximum Black Duck API requests per second (default unlimited)",
+                        type=float, default=0)
+    parser.add_argument("--api_max_inflight", help="Maximum Black Duck API requests in progress at once "
+                                                   "(default unlimited)", type=int, default=0)
+    parser.add_argument("--api_stats", help="Record the latency of Black Duck API calls and write the statistics "
+                                            "to this file at exit", default="")
+    parser.add_argument("--api_stats_format", help="Format of the API statistics file (default json)",
+                        choices=['json', 'openmetrics'], default='json')
+    parser.add_argument("--ignore_batch_size", help="Number of components ignored per Black Duck API request "
+                                                    "(default 99)", type=int, default=99)
+    parser.add_argument("--ignore_report", help="Write a JSON report of the components ignored after Signature matching "
+                                                "to this file", default="")
+    parser.add_argument("--no_ignore_cache", help="Do not reuse partial component ignore decisions from previous runs",
+                        action='store_true')
+    parser.add_argument("--http_cache", help="Cache Black Duck API responses locally and revalidate them using "
+                                             "conditional requests", action='store_true')
+    parser.add_argument("--http_cache_ttl", help="Time (seconds) cached vulnerability details are reused without "
+                                                 "revalidation (default 86400)", type=int, default=86400)
+    parser.add_argument("--spdx", help="Use the SPDX documents created by the create-spdx class to locate recipe "
+                                       "sources and layers", action='store_true')
+    parser.add_argument("--spdx_dir", help="SPDX deploy folder (default DEPLOY_DIR/spdx)", default="")
+    parser.add_argument("--run_dir", help="Save the outputs of each phase to this folder so a failed run can be "
+                                          "resumed", default="")
+    parser.add_argument("--resume", help="Resume the run saved in this folder (from --run_dir), skipping "
+                                         "completed phases", default="")
+    parser.add_argument("--watch", help="Keep running and scan each new license.manifest or CVE check file "
+                                        "produced for the target", action='store_true')
+    parser.add_argument("--watch_interval", help="Time (seconds) between checks for new build outputs in watch "
+                                                 "mode (default 60)", type=int, default=60)
+
+    return parser
+
+
+args = None
+
+
+def parse_args():
+    global args
+
+    args = get_parser().parse_args()
 
 
 def check_args():
@@ -223,6 +299,20 @@ def check_args():
     if args.exclude_layers != '':
         global_values.exclude_layers = args.exclude_layers.split(',')
 
+    if args.use_workdir:
+        global_values.use_workdir = True
+
+    if args.layer_profiles != '':
+        for entry in args.layer_profiles.split(','):
+            arr = entry.split('=')
+            modes = arr[1].split('+') if len(arr) == 2 else []
+            if len(arr) != 2 or arr[0] == '' or len(modes) == 0 or \
+                    any(mode not in ['signature', 'snippets', 'binary'] for mode in modes):
+                logging.error(f"Invalid layer scan profile '{entry}' (expected layer=modes where modes are "
+                              f"signature, snippets or binary joined with '+')")
+                sys.exit(2)
+            global_values.layer_profiles[arr[0]] = ('snippets' in modes, 'binary' in modes)
+
     if args.detect_opts != '':
         global_values.detect_opts = args.detect_opts
 
@@ -235,12 +325,121 @@ def check_args():
     if args.binary_scan:
         global_values.binary_scan = True
 
+    if args.no_binary_cache:
+        global_values.binary_cache = False
+
+    if args.binary_scan_threads > 0:
+        global_values.binary_scan_threads = args.binary_scan_threads
+
     if args.detect_fix:
         global_values.detect_fix = True
 
     if args.no_unmap:
         global_values.unmap = False
 
+    if args.cache_dir != '':
+        global_values.cache_dir = os.path.abspath(args.cache_dir)
+    else:
+        global_values.cache_dir = os.path.join(os.path.expanduser('~'), '.bd_scan_yocto')
+
+    if args.sigscan_cache:
+        if len(global_values.layer_profiles) > 0:
+            logging.warning("Option --sigscan_cache cannot be used with --layer_profiles - ignoring")
+        else:
+            global_values.sigscan_cache = True
+
+    global_values.extract_profile = args.extract_profile
+    if args.extract_include_exts != '':
+        global_values.extract_include_exts = ['.' + ext.strip().lower().lstrip('.') for ext in
+                                              args.extract_include_exts.split(',')]
+    if args.extract_exclude_exts != '':
+        global_values.extract_exclude_exts = ['.' + ext.strip().lower().lstrip('.') for ext in
+                                              args.extract_exclude_exts.split(',')]
+    if args.extract_exclude_paths != '':
+        global_values.extract_exclude_paths = args.extract_exclude_paths.split(',')
+    if args.extract_max_file_size > 0:
+        global_values.extract_max_file_size = args.extract_max_file_size * 1024
+
+    if args.max_stage_size > 0:
+        if global_values.sigscan_cache:
+            logging.warning("Option --max_stage_size is not required with --sigscan_cache (packages are staged "
+                            "individually) - ignoring")
+        elif len(global_values.layer_profiles) > 0:
+            logging.warning("Option --max_stage_size cannot be used with --layer_profiles - ignoring")
+        else:
+            global_values.max_stage_size = args.max_stage_size * 1024 * 1024
+
+    if args.api_threads > 0:
+        global_values.api_threads = args.api_threads
+
+    if args.api_rate > 0:
+        global_values.api_rate = args.api_rate
+    if args.api_max_inflight > 0:
+        global_values.api_max_inflight = args.api_max_inflight
+
+    if args.api_stats != '':
+        global_values.api_stats = args.api_stats
+        global_values.api_stats_format = args.api_stats_format
+        from bd_scan_yocto import apistats
+        atexit.register(apistats.report)
+
+    if args.ignore_batch_size > 0:
+        global_values.ignore_batch_size = args.ignore_batch_size
+
+    if args.ignore_report != '':
+        global_values.ignore_report = args.ignore_report
+
+    if args.no_ignore_cache:
+        global_values.ignore_cache = False
+
+    if args.http_cache:
+        global_values.http_cache = True
+        global_values.http_cache_ttl = args.http_cache_ttl
+        from bd_scan_yocto import httpcache
+        atexit.register(httpcache.log_stats)
+
+    if args.watch:
+        if args.watch_interval < 1:
+            logging.error("Option --watch_interval must be at least 1 second")
+            sys.exit(2)
+        global_values.watch = True
+        global_values.watch_interval = args.watch_interval
+
+    if args.spdx:
+        global_values.use_spdx = True
+        if args.spdx_dir != '':
+            if not os.path.isdir(args.spdx_dir):
+                logging.error(f"SPDX folder '{args.spdx_dir}' does not exist")
+                sys.exit(2)
+            global_values.spdx_dir = args.spdx_dir
+
+    if args.run_dir != '' or args.resume != '':
+        from bd_scan_yocto import checkpoint
+        if args.watch:
+            logging.warning("Options --run_dir and --resume cannot be used with --watch - ignoring")
+        elif args.resume != '':
+            if not os.path.isdir(args.resume):
+                logging.error(f"Run folder '{args.resume}' does not exist - cannot resume")
+                sys.exit(2)
+            global_values.run_dir = os.path.abspath(args.resume)
+            if not checkpoint.init(True):
+                sys.exit(2)
+        else:
+            global_values.run_dir = os.path.abspath(args.run_dir)
+            checkpoint.init(False)
+
+    if args.staging_dir != '':
+        if global_values.sigscan_cache or global_values.max_stage_size > 0 or len(global_values.layer_profiles) > 0:
+            logging.warning("Option --staging_dir cannot be used with --sigscan_cache, --max_stage_size or "
+                            "--layer_profiles - ignoring")
+        else:
+            # Separate staging folder per project version
+            global_values.staging_dir = os.path.join(os.path.abspath(args.staging_dir),
+                                                     re.sub('[^\\w.-]', '_', args.project),
+                                                     re.sub('[^\\w.-]', '_', args.version))
+            if not os.path.isdir(global_values.staging_dir):
+                os.makedirs(global_values.staging_dir)
+
     # if args.bblayers_out != "":
     #     if args.extended_scan_layers:
     #         print(f"INFO: Bitbake-layers output file {args.bblayers_out} is not required unless "
@@ -257,12 +456,23 @@ def connect():
     if global_values.bd_url == '':
         return None
 
+    from blackduck import Client
+
     bd = Client(
         token=global_values.bd_api,
         base_url=global_values.bd_url,
         timeout=30,
         verify=(not global_values.bd_trustcert)  # TLS certificate verification
     )
+    if global_values.api_stats != '':
+        from bd_scan_yocto import apistats
+        apistats.install(bd.session)
+    from bd_scan_yocto import ratelimit
+    ratelimit.install(bd.session)
+    atexit.register(ratelimit.log_stats)
+    if global_values.http_cache:
+        from bd_scan_yocto import httpcache
+        httpcache.install(bd.session)
     try:
         bd.list_resources()
     except Exception as exc:
@@ -296,7 +506,7 @@ def get_bitbake_env():
         for mline in lines:
             if re.search(
                     "^(MANIFEST_FILE|DEPLOY_DIR|MACHINE_ARCH|DL_DIR|DEPLOY_DIR_RPM|"
-                    "DEPLOY_DIR_IPK|DEPLOY_DIR_DEB|IMAGE_PKGTYPE)=",
+                    "DEPLOY_DIR_IPK|DEPLOY_DIR_DEB|IMAGE_PKGTYPE|TMPDIR)=",
                     mline):
 
                 # if re.search('^TMPDIR=', mline):
@@ -314,6 +524,9 @@ def get_bitbake_env():
                 elif global_values.download_dir == '' and re.search('^DL_DIR=', mline):
                     global_values.download_dir = val
                     logging.info(f"Bitbake Env: download_dir={global_values.download_dir}")
+                elif global_values.tmp_dir == '' and re.search('^TMPDIR=', mline):
+                    global_values.tmp_dir = val
+                    logging.info(f"Bitbake Env: tmpdir={global_values.tmp_dir}")
                 elif rpm_dir == '' and re.search('^DEPLOY_DIR_RPM=', mline):
                     rpm_dir = val
                     logging.info(f"Bitbake Env: rpm_dir={rpm_dir}")
@@ -352,6 +565,11 @@ def get_bitbake_env():
 def find_yocto_files():
     machine = global_values.machine.replace('_', '-')
 
+    if global_values.use_workdir and (global_values.tmp_dir == '' or
+                                      not os.path.isdir(os.path.join(global_values.tmp_dir, 'work'))):
+        logging.warning("Build work folder (TMPDIR/work) could not be located - package files will be extracted")
+        global_values.use_workdir = False
+
     if global_values.manifest_file == "":
         if global_values.target == '':
             logging.warning("Manifest file not specified and it could not be determined as Target not specified")
@@ -370,6 +588,19 @@ def find_yocto_files():
                 logging.info(f"Located license.manifest file {manifest}")
                 global_values.manifest_file = manifest
 
+    if global_values.use_spdx:
+        from bd_scan_yocto import spdx
+        spdx_dir = global_values.spdx_dir
+        if spdx_dir == '':
+            spdx_dir = os.path.join(global_values.deploy_dir, "spdx")
+        locations = spdx.find_spdx_docs(spdx_dir)
+        if len(locations) == 0:
+            logging.warning(f"No recipe SPDX documents found in {spdx_dir} - using license.manifest and download "
+                            f"folder matching only")
+        else:
+            logging.info(f"Located recipe SPDX documents {', '.join(locations)}")
+            global_values.spdx_locations = locations
+
     if global_values.cve_check_file == '' and global_values.cve_check:
         if global_values.target == '':
             logging.warning("CVE check file not specified and it could not be determined as Target not specified")
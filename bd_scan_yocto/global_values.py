@@ -5,6 +5,10 @@ bdio_comps_recipes = []
 packages_list = []
 recipes_dict = {}
 recipe_layer_dict = {}
+recipe_srcrev_dict = {}
+git_mirror_revs = {}
+spdx_sources = {}
+pkg_recipe_dict = {}
 layers_list = []
 bdio_proj_rel_list = []
 # replace_recipes_dict = {}
@@ -21,6 +25,7 @@ oe_build_envpath = '.'
 build_dir = ''
 deploy_dir = ''
 download_dir = ''
+tmp_dir = ''
 pkg_dir = ''
 image_pkgtype = ''
 manifest_file = ''
@@ -41,6 +46,37 @@ snippets = False
 ignore_components = True
 binary_scan = False
 binary_scan_exts = "*.rpm,*.deb,*.tar,*.gz,*.ipk,*.zip,*.xz"
+binary_cache = True
+binary_scan_threads = 4
 detect_fix = False
 no_init_script = False
 unmap = False
+cache_dir = ''
+sigscan_cache = False
+extract_profile = 'source'
+extract_include_exts = []
+extract_exclude_exts = []
+extract_exclude_paths = []
+extract_max_file_size = 0
+max_stage_size = 0
+staging_dir = ''
+api_threads = 4
+api_retries = 3
+api_rate = 0
+api_max_inflight = 0
+ignore_batch_size = 99
+ignore_report = ''
+ignore_cache = True
+http_cache = False
+http_cache_ttl = 86400
+watch = False
+watch_interval = 60
+run_dir = ''
+use_spdx = False
+spdx_dir = ''
+spdx_locations = []
+api_stats = ''
+api_stats_format = 'json'
+api_phase = 'setup'
+layer_profiles = {}
+use_workdir = False
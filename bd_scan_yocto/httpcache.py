@@ -0,0 +1,287 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+import requests
+
+from bd_scan_yocto import global_values
+
+# Resources which do not change and can be reused without revalidation within the TTL
+immutable_regex = re.compile(r'/api/vulnerabilities/[^/?]+$')
+
+stats = {
+    'requests': 0,
+    'fresh': 0,
+    'revalidated': 0,
+    'stored': 0,
+    'bytes_saved': 0,
+}
+stats_lock = threading.Lock()
+
+
+def add_stat(name, value=1):
+    with stats_lock:
+        stats[name] += value
+
+
+def get_cache_dir():
+    cdir = os.path.join(global_values.cache_dir, 'http')
+    if not os.path.isdir(cdir):
+        os.makedirs(cdir, exist_ok=True)
+    return cdir
+
+
+def get_key(url, accept):
+    # Responses depend on the permissions of the API token user
+    token_id = hashlib.sha256(global_values.bd_api.encode('utf-8')).hexdigest()
+    return hashlib.sha256(f"{url}|{accept}|{token_id}".encode('utf-8')).hexdigest()
+
+
+def load_meta(key):
+    metafile = os.path.join(get_cache_dir(), key + '.json')
+    if not os.path.isfile(metafile) or not os.path.isfile(os.path.join(get_cache_dir(), key + '.body')):
+        return None
+    try:
+        with open(metafile, 'r') as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+
+def get_body_file(key):
+    return os.path.join(get_cache_dir(), key + '.body')
+
+
+def is_fresh(meta):
+    return meta['immutable'] and time.time() - meta['stored'] < global_values.http_cache_ttl
+
+
+def is_cacheable(url, headers):
+    return immutable_regex.search(url.split('?')[0]) is not None or \
+        'ETag' in headers or 'Last-Modified' in headers
+
+
+def get_conditional_headers(meta):
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+    return headers
+
+
+def new_body_file():
+    return tempfile.NamedTemporaryFile(dir=get_cache_dir(), prefix='.tmp', delete=False)
+
+
+def commit(key, url, headers, tmpname, size):
+    meta = {
+        'url': url,
+        'etag': headers.get('ETag', ''),
+        'last_modified': headers.get('Last-Modified', ''),
+        'content_type': headers.get('Content-Type', ''),
+        'immutable': immutable_regex.search(url.split('?')[0]) is not None,
+        'stored': time.time(),
+        'size': size,
+    }
+    os.replace(tmpname, get_body_file(key))
+    # Concurrent requests for the same URL each write their own temporary file
+    with tempfile.NamedTemporaryFile('w', dir=get_cache_dir(), prefix='.tmp', suffix='.json', delete=False) as f:
+        json.dump(meta, f)
+    os.replace(f.name, os.path.join(get_cache_dir(), key + '.json'))
+    add_stat('stored')
+
+
+def log_stats():
+    if stats['requests'] == 0:
+        return
+    hits = stats['fresh'] + stats['revalidated']
+    logging.info(f"HTTP cache: {stats['requests']} requests, {hits} hits ({100 * hits / stats['requests']:.0f}%) - "
+                 f"{stats['fresh']} fresh, {stats['revalidated']} revalidated, {stats['stored']} stored, "
+                 f"{stats['bytes_saved'] / (1024 * 1024):.1f} MB not downloaded")
+
+
+def install(session):
+    for prefix, adapter in list(session.adapters.items()):
+        if not isinstance(adapter, CachingAdapter):
+            session.mount(prefix, CachingAdapter(adapter))
+
+
+class CachedBody:
+    # Raw response body read from the cache, closing the file once it has been read completely
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+
+    def read(self, amt=None, decode_content=True, **kwargs):
+        if self.file is None:
+            return b''
+        data = self.file.read() if amt is None else self.file.read(amt)
+        if amt is None or not data:
+            self.close()
+        return data
+
+    def stream(self, amt=65536, decode_content=True):
+        while True:
+            data = self.read(amt)
+            if not data:
+                break
+            yield data
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class CachingStream:
+    # Wraps the raw response to store the (decoded) body in the cache as it is read by the caller
+
+    def __init__(self, raw, key, url, headers):
+        self.raw = raw
+        self.key = key
+        self.url = url
+        self.headers = headers
+        self.file = new_body_file()
+        self.size = 0
+
+    def write(self, data):
+        if self.file is not None and data:
+            self.file.write(data)
+            self.size += len(data)
+
+    def finish(self):
+        # Only store the response if it is read completely
+        if self.file is not None:
+            self.file.close()
+            commit(self.key, self.url, self.headers, self.file.name, self.size)
+            self.file = None
+
+    def stream(self, amt=65536, decode_content=True):
+        for chunk in self.raw.stream(amt, decode_content=True):
+            self.write(chunk)
+            yield chunk
+        self.finish()
+
+    def read(self, amt=None, decode_content=True, **kwargs):
+        data = self.raw.read(amt, decode_content=True)
+        self.write(data)
+        if amt is None or not data:
+            self.finish()
+        return data
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            os.remove(self.file.name)
+            self.file = None
+        self.raw.close()
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+class CachingAdapter(requests.adapters.BaseAdapter):
+    # Wraps the session transport adapter to serve GET requests from the local cache
+
+    def __init__(self, adapter):
+        super().__init__()
+        self.adapter = adapter
+
+    def build_response(self, request, meta, key):
+        resp = requests.models.Response()
+        resp.status_code = 200
+        resp.reason = 'OK'
+        resp.url = request.url
+        resp.request = request
+        if meta['content_type'] != '':
+            resp.headers['Content-Type'] = meta['content_type']
+        resp.encoding = requests.utils.get_encoding_from_headers(resp.headers)
+        resp.raw = CachedBody(get_body_file(key))
+        add_stat('bytes_saved', meta['size'])
+        return resp
+
+    def send(self, request, **kwargs):
+        if request.method != 'GET':
+            return self.adapter.send(request, **kwargs)
+
+        add_stat('requests')
+        key = get_key(request.url, request.headers.get('Accept', ''))
+        meta = load_meta(key)
+        if meta is not None:
+            if is_fresh(meta):
+                add_stat('fresh')
+                return self.build_response(request, meta, key)
+            request.headers.update(get_conditional_headers(meta))
+
+        resp = self.adapter.send(request, **kwargs)
+        if resp.status_code == 304 and meta is not None:
+            resp.close()
+            add_stat('revalidated')
+            return self.build_response(request, meta, key)
+
+        if resp.status_code == 200 and is_cacheable(request.url, resp.headers):
+            # The (decoded) body is written to the cache while the caller reads it
+            resp.raw = CachingStream(resp.raw, key, request.url, resp.headers.copy())
+            for header in ['Content-Encoding', 'Content-Length', 'Transfer-Encoding']:
+                resp.headers.pop(header, None)
+        return resp
+
+    def close(self):
+        self.adapter.close()
+
+
+async def aiter_chunks(client, url, headers):
+    if not global_values.http_cache:
+        async with await client.request('GET', url, headers=headers) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(65536):
+                yield chunk
+        return
+
+    add_stat('requests')
+    key = get_key(url, headers.get('accept', headers.get('Accept', '')))
+    meta = load_meta(key)
+    if meta is not None:
+        if is_fresh(meta):
+            add_stat('fresh')
+            add_stat('bytes_saved', meta['size'])
+            with open(get_body_file(key), 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    yield chunk
+            return
+        headers = dict(headers, **get_conditional_headers(meta))
+
+    async with await client.request('GET', url, headers=headers) as resp:
+        if resp.status == 304 and meta is not None:
+            add_stat('revalidated')
+            add_stat('bytes_saved', meta['size'])
+            with open(get_body_file(key), 'rb') as f:
+                for chunk in iter(lambda: f.read(65536), b''):
+                    yield chunk
+            return
+
+        resp.raise_for_status()
+        if not is_cacheable(url, resp.headers):
+            async for chunk in resp.content.iter_chunked(65536):
+                yield chunk
+            return
+
+        # Only store the response if it is read completely
+        size = 0
+        f = new_body_file()
+        try:
+            async for chunk in resp.content.iter_chunked(65536):
+                f.write(chunk)
+                size += len(chunk)
+                yield chunk
+            f.close()
+            commit(key, url, resp.headers, f.name, size)
+        finally:
+            if not f.closed:
+                f.close()
+                os.remove(f.name)
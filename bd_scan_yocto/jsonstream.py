@@ -0,0 +1,131 @@
+import re
+import json
+import codecs
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# Remainders at the end of the buffer which are the start of a valid token (number, literal or unicode escape)
+PARTIAL_TOKEN = re.compile(r'(?:[.eE][-+]?|-|t(?:ru?)?|f(?:a(?:ls?)?)?|n(?:ul?)?|u[0-9a-fA-F]{0,4})?')
+CHUNK_SIZE = 65536
+
+
+class ItemStreamParser:
+    # Incrementally parses a JSON object, returning entries of the 'items' array as soon as each is complete.
+    # Other top level fields (for example totalCount) are stored in fields.
+
+    def __init__(self, fields=None):
+        self.decoder = json.JSONDecoder()
+        self.textdecoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.state = 'start'
+        self.key = ''
+        if fields is None:
+            fields = {}
+        self.fields = fields
+
+    def skip_whitespace(self):
+        self.pos = WHITESPACE.match(self.buf, self.pos).end()
+        return self.pos < len(self.buf)
+
+    def decode_value(self):
+        # Values are only accepted when followed by another character so numbers are not truncated
+        try:
+            value, end = self.decoder.raw_decode(self.buf, self.pos)
+        except json.JSONDecodeError as e:
+            # Only wait for more data where the value is truncated, otherwise the content is malformed
+            if e.msg.startswith('Unterminated string') or PARTIAL_TOKEN.fullmatch(self.buf, e.pos) is not None:
+                return False, None
+            raise ValueError(f"Invalid JSON content - {str(e)}")
+        if end >= len(self.buf):
+            return False, None
+        self.pos = end
+        return True, value
+
+    def feed(self, data):
+        if isinstance(data, bytes):
+            data = self.textdecoder.decode(data)
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+
+        items = []
+        while self.skip_whitespace():
+            char = self.buf[self.pos]
+            if self.state == 'start':
+                if char != '{':
+                    raise ValueError(f"Unexpected JSON content '{char}' (expected object)")
+                self.pos += 1
+                self.state = 'key'
+            elif self.state == 'key':
+                if char == '}':
+                    self.pos += 1
+                    self.state = 'done'
+                    continue
+                ok, key = self.decode_value()
+                if not ok:
+                    break
+                self.key = key
+                self.state = 'colon'
+            elif self.state == 'colon':
+                if char != ':':
+                    raise ValueError(f"Unexpected JSON content '{char}' (expected ':')")
+                self.pos += 1
+                self.state = 'value'
+            elif self.state == 'value':
+                if self.key == 'items' and char == '[':
+                    self.pos += 1
+                    self.state = 'items'
+                    continue
+                ok, value = self.decode_value()
+                if not ok:
+                    break
+                self.fields[self.key] = value
+                self.state = 'next'
+            elif self.state == 'items':
+                if char == ']':
+                    self.pos += 1
+                    self.state = 'next'
+                    continue
+                if char == ',':
+                    self.pos += 1
+                    continue
+                ok, item = self.decode_value()
+                if not ok:
+                    break
+                items.append(item)
+            elif self.state == 'next':
+                if char == ',':
+                    self.state = 'key'
+                elif char == '}':
+                    self.state = 'done'
+                else:
+                    raise ValueError(f"Unexpected JSON content '{char}' (expected ',' or '}}')")
+                self.pos += 1
+            else:
+                break
+        return items
+
+    def close(self):
+        # The stream must end after the complete object so truncated pages are not treated as complete
+        if self.state != 'done':
+            raise ValueError(f"Incomplete JSON content (ended in state '{self.state}')")
+
+
+def iter_items(bd, url, headers=None, fields=None):
+    resp = bd.session.get(url, headers=headers, stream=True)
+    try:
+        resp.raise_for_status()
+        parser = ItemStreamParser(fields)
+        for chunk in resp.iter_content(CHUNK_SIZE):
+            for item in parser.feed(chunk):
+                yield item
+        parser.close()
+    finally:
+        resp.close()
+
+
+async def aiter_items(chunks, fields=None):
+    parser = ItemStreamParser(fields)
+    async for chunk in chunks:
+        for item in parser.feed(chunk):
+            yield item
+    parser.close()
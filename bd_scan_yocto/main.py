@@ -2,16 +2,18 @@
 import sys
 import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 from bd_scan_yocto import global_values
 from bd_scan_yocto import config
 from bd_scan_yocto import process
 from bd_scan_yocto import utils
-from bd_scan_yocto import bd_scan_process
+from bd_scan_yocto import checkpoint
 
 
 def main():
 
+    config.parse_args()
     config.check_args()
 
     config.get_bitbake_env()
@@ -33,83 +35,73 @@ def main():
         sys.exit(3)
     global_values.bd = bd
 
-    if not config.args.cve_check_only:
-        logging.info('----------------------------------   PHASE 1  ----------------------------------')
-        if not global_values.skip_detect_for_bitbake:
-            bd_scan_process.run_detect_for_bitbake()
-        else:
-            logging.info('Skipping Detect BITBAKE scan ...')
+    if global_values.watch:
+        from bd_scan_yocto import watch
+        watch.watch_builds(run_scan)
+        return
+
+    run_scan(bd, config.args.cve_check_only)
+    logging.info("\nDone")
+
 
-        process.proc_yocto_project(global_values.manifest_file)
+def run_scan(bd, cve_check_only):
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        # The cve_check file does not depend on any other phase so is read in the background
+        cve_future = None
+        if global_values.cve_check_file != "" and not config.args.no_cve_check:
+            cve_future = executor.submit(process.proc_cve_file, global_values.cve_check_file)
 
-    logging.info('----------------------------------   PHASE 7  ----------------------------------')
-    if global_values.cve_check_file != "" and not config.args.no_cve_check:
+        if not cve_check_only:
+            process.proc_yocto_project(global_values.manifest_file, executor)
 
-        logging.info("\nProcessing CVEs ...")
+        logging.info('----------------------------------   PHASE 7  ----------------------------------')
+        global_values.api_phase = '7'
+        if cve_future is not None and checkpoint.is_done('cves'):
+            logging.info('Patched CVEs updated in resumed run - skipping CVE processing')
+        elif cve_future is not None:
 
-        # if not config.args.cve_check_only:
-        #     print("Waiting for Black Duck server scan completion before continuing ...")
-        #     # Need to wait for scan to process into queue - sleep 15
-        #     time.sleep(0)
+            logging.info("\nProcessing CVEs ...")
 
-        try:
-            logging.info("- Reading Black Duck project ...")
-            proj, ver = utils.get_projver(bd, config.args)
-            count = 1
-            while ver is None:
-                time.sleep(10)
+            # if not cve_check_only:
+            #     print("Waiting for Black Duck server scan completion before continuing ...")
+            #     # Need to wait for scan to process into queue - sleep 15
+            #     time.sleep(0)
+
+            try:
+                logging.info("- Reading Black Duck project ...")
                 proj, ver = utils.get_projver(bd, config.args)
-                count += 1
-                if count > 20:
-                    logging.error(f"Unable to locate project {proj} and version '{ver}' - terminating")
-                    sys.exit(1)
-
-        except Exception as e:
-            logging.error("Unable to get project version from API\n" + str(e))
-            sys.exit(3)
-
-        logging.info("- Loading CVEs from cve_check log ...")
-
-        try:
-            cvefile = open(global_values.cve_check_file, "r")
-            cvelines = cvefile.readlines()
-            cvefile.close()
-        except Exception as e:
-            logging.error("Unable to open CVE check output file\n" + str(e))
-            sys.exit(3)
-
-        patched_vulns = []
-        pkgvuln = {}
-        cves_in_bm = 0
-        for line in cvelines:
-            arr = line.split(":")
-            if len(arr) > 1:
-                key = arr[0]
-                value = arr[1].strip()
-                if key == "PACKAGE NAME":
-                    pkgvuln['package'] = value
-                elif key == "PACKAGE VERSION":
-                    pkgvuln['version'] = value
-                elif key == "CVE":
-                    pkgvuln['CVE'] = value
-                elif key == "CVE STATUS":
-                    pkgvuln['status'] = value
-                    if pkgvuln['status'] == "Patched":
-                        patched_vulns.append(pkgvuln['CVE'])
-                        if pkgvuln['package'] in global_values.packages_list:
-                            cves_in_bm += 1
-                    pkgvuln = {}
-
-        logging.info(f"      {len(patched_vulns)} total patched CVEs identified")
-        if not config.args.cve_check_only:
-            logging.info(
-                f'''      {cves_in_bm} Patched CVEs within packages in build manifest (including potentially mismatched 
-            CVEs which should be ignored)''')
-        if len(patched_vulns) > 0:
-            process.process_patched_cves(bd, ver, patched_vulns)
-    else:
-        logging.info('Skipping CVE processing')
-    logging.info("\nDone")
+                count = 1
+                while ver is None:
+                    time.sleep(10)
+                    proj, ver = utils.get_projver(bd, config.args)
+                    count += 1
+                    if count > 20:
+                        logging.error(f"Unable to locate project {proj} and version '{ver}' - terminating")
+                        sys.exit(1)
+
+            except Exception as e:
+                logging.error("Unable to get project version from API\n" + str(e))
+                sys.exit(3)
+
+            logging.info("- Loading CVEs from cve_check log ...")
+            patched_list = cve_future.result()
+
+            patched_vulns = []
+            cves_in_bm = 0
+            for package, cve in patched_list:
+                patched_vulns.append(cve)
+                if package in global_values.packages_list:
+                    cves_in_bm += 1
+
+            logging.info(f"      {len(patched_vulns)} total patched CVEs identified")
+            if not cve_check_only:
+                logging.info(
+                    f'''      {cves_in_bm} Patched CVEs within packages in build manifest (including potentially mismatched 
+                CVEs which should be ignored)''')
+            if len(patched_vulns) > 0:
+                process.process_patched_cves(bd, ver, patched_vulns)
+        else:
+            logging.info('Skipping CVE processing')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,219 @@
+import os
+import io
+import json
+import struct
+import tarfile
+import logging
+
+from bd_scan_yocto import global_values
+
+RPM_LEAD_SIZE = 96
+RPM_HEADER_MAGIC = b'\x8e\xad\xe8\x01'
+RPMTAG_NAME = 1000
+RPMTAG_VERSION = 1001
+RPMTAG_SOURCERPM = 1044
+
+split_pkg_suffixes = ['-dbg', '-dev', '-src', '-staticdev', '-doc', '-ptest']
+
+
+def read_rpm_header(f):
+    intro = f.read(16)
+    if len(intro) != 16 or intro[:4] != RPM_HEADER_MAGIC:
+        return None
+    nindex, hsize = struct.unpack('>II', intro[8:16])
+    index = f.read(nindex * 16)
+    store = f.read(hsize)
+    if len(index) != nindex * 16 or len(store) != hsize:
+        return None
+
+    tags = {}
+    for i in range(nindex):
+        tag, ttype, offset, count = struct.unpack('>iiii', index[i * 16:(i + 1) * 16])
+        # Only string tags are required
+        if ttype == 6 and 0 <= offset < hsize:
+            end = store.find(b'\x00', offset)
+            tags[tag] = store[offset:end].decode('utf-8', errors='replace')
+    return tags, hsize
+
+
+def get_rpm_recipe(path):
+    with open(path, 'rb') as f:
+        f.seek(RPM_LEAD_SIZE)
+        # Signature header is padded to 8 byte boundary
+        sig = read_rpm_header(f)
+        if sig is None:
+            return None
+        f.seek((8 - sig[1] % 8) % 8, 1)
+        hdr = read_rpm_header(f)
+        if hdr is None:
+            return None
+    tags = hdr[0]
+    if RPMTAG_SOURCERPM not in tags:
+        return None
+
+    # Source RPM name is <recipe>-<version>-<release>.src.rpm
+    srpm = tags[RPMTAG_SOURCERPM]
+    arr = srpm.rsplit('-', 2)
+    if len(arr) != 3:
+        return None
+    return arr[0], arr[1], tags.get(RPMTAG_NAME, '')
+
+
+def read_ar_members(f):
+    if f.read(8) != b'!<arch>\n':
+        return None
+    members = {}
+    while True:
+        hdr = f.read(60)
+        if len(hdr) < 60:
+            break
+        name = hdr[:16].decode('utf-8').strip().rstrip('/')
+        size = int(hdr[48:58].decode('utf-8').strip())
+        if name.startswith('control.tar') or name == 'debian-binary':
+            members[name] = f.read(size)
+            if size % 2 == 1:
+                f.read(1)
+        else:
+            # Skip the (large) data archive without reading it
+            f.seek(size + size % 2, 1)
+    return members
+
+
+def read_control(path):
+    with open(path, 'rb') as f:
+        members = read_ar_members(f)
+    if members is None:
+        # Older ipk files are gzipped tar archives
+        try:
+            with tarfile.open(path) as tfile:
+                member = tfile.extractfile('./control.tar.gz')
+                members = {'control.tar.gz': member.read()}
+        except Exception:
+            return None
+
+    for name, data in members.items():
+        if not name.startswith('control.tar'):
+            continue
+        try:
+            with tarfile.open(fileobj=io.BytesIO(data)) as ctar:
+                for cname in ['./control', 'control']:
+                    try:
+                        return ctar.extractfile(cname).read().decode('utf-8', errors='replace')
+                    except KeyError:
+                        continue
+        except tarfile.TarError:
+            # For example control.tar.zst is not supported by tarfile
+            return None
+    return None
+
+
+def get_control_recipe(path):
+    control = read_control(path)
+    if control is None:
+        return None
+
+    fields = {}
+    for line in control.splitlines():
+        arr = line.split(':', 1)
+        if len(arr) == 2 and not line.startswith(' '):
+            fields[arr[0].strip()] = arr[1].strip()
+
+    # OE field contains the recipe name (PN), Source can contain the SRC_URI files for ipk packages
+    if 'OE' in fields:
+        recipe = fields['OE']
+    elif 'Source' in fields and fields['Source'].find('.') < 0:
+        recipe = fields['Source'].split()[0]
+    else:
+        return None
+    ver = fields.get('Version', '')
+    if ver.find(':') >= 0:
+        ver = ver.split(':', 1)[1]
+    ver = ver.rsplit('-', 1)[0]
+    return recipe, ver, fields.get('Package', '')
+
+
+def get_pkg_recipe(path):
+    try:
+        if path.endswith('.rpm'):
+            return get_rpm_recipe(path)
+        elif path.endswith('.ipk') or path.endswith('.deb'):
+            return get_control_recipe(path)
+    except Exception as e:
+        logging.debug(f"Unable to read package metadata from {path} - {str(e)}")
+    return None
+
+
+def load_index_cache(cachefile):
+    if not os.path.isfile(cachefile):
+        return {}
+    try:
+        with open(cachefile, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        logging.warning(f"Unable to read package index cache {cachefile} - {str(e)}")
+        return {}
+
+
+def save_index_cache(cachefile, index_cache):
+    try:
+        if not os.path.isdir(os.path.dirname(cachefile)):
+            os.makedirs(os.path.dirname(cachefile))
+        with open(cachefile + '.tmp', 'w') as f:
+            json.dump(index_cache, f)
+        os.replace(cachefile + '.tmp', cachefile)
+    except Exception as e:
+        logging.warning(f"Unable to write package index cache {cachefile} - {str(e)}")
+
+
+def get_pkg_index(package_paths_list):
+    cachefile = os.path.join(global_values.cache_dir, 'pkgindex.json')
+    old_cache = load_index_cache(cachefile)
+    index_cache = {}
+    pkg_index = {}
+    unindexed_list = []
+    read_count = 0
+    for path in package_paths_list:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entry = old_cache.get(path)
+        # Entries from older versions do not contain the package name
+        if entry is None or entry[0] != st.st_size or entry[1] != st.st_mtime or \
+                (entry[2] is not None and len(entry[2]) != 3):
+            res = get_pkg_recipe(path)
+            read_count += 1
+            entry = [st.st_size, st.st_mtime, res]
+        index_cache[path] = entry
+
+        if entry[2] is None:
+            unindexed_list.append(path)
+            continue
+        recipe, ver, name = entry[2]
+        if recipe not in pkg_index.keys():
+            pkg_index[recipe] = []
+        pkg_index[recipe].append((path, ver, name))
+
+    save_index_cache(cachefile, index_cache)
+    logging.info(f"- Indexed {len(index_cache)} package files ({read_count} read, "
+                 f"{len(unindexed_list)} without recipe metadata)")
+    return pkg_index, unindexed_list
+
+
+def is_image_pkg(name):
+    # Split packages (-dbg, -dev, -src etc.) built from the recipe are only included if installed in the image
+    if name == '':
+        return True
+    if len(global_values.packages_list) > 0:
+        return name in global_values.packages_list
+    if name.find('-locale-') >= 0:
+        return False
+    return not any(name.endswith(suffix) for suffix in split_pkg_suffixes)
+
+
+def match_version(pkgver, ver):
+    if ver.find(':') >= 0:
+        ver = ver.split(':', 1)[1]
+    if pkgver == ver:
+        return True
+    return pkgver.split('+')[0] == ver
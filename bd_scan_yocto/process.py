@@ -1,10 +1,12 @@
 import os
+import collections
 # import uuid
 # import datetime
 import sys
 import re
 import subprocess
 import logging
+import time
 
 import glob
 
@@ -12,13 +14,21 @@ from bd_scan_yocto import global_values
 from bd_scan_yocto import utils
 from bd_scan_yocto import config
 from bd_scan_yocto import bd_scan_process
-from bd_scan_yocto import bd_process_bom
+from bd_scan_yocto import sigcache
+from bd_scan_yocto import bincache
+from bd_scan_yocto import pkgindex
+from bd_scan_yocto import spdx
+from bd_scan_yocto import srcfilter
+from bd_scan_yocto import workdir
+from bd_scan_yocto import jsonstream
+from bd_scan_yocto import checkpoint
 
 
 def proc_license_manifest(liclines):
     logging.info("- Working on recipes from license.manifest: ...")
     entries = 0
     ver = ''
+    srcrev = ''
     for line in liclines:
         arr = line.split(":")
         if len(arr) > 1:
@@ -28,10 +38,18 @@ def proc_license_manifest(liclines):
                 global_values.packages_list.append(value)
             elif key == "PACKAGE VERSION":
                 ver = value.split('+')[0]
+                # Git recipes include the SRCREV in the version (e.g. 1.0+gitAUTOINC+0123456789-r0)
+                srcrev_res = re.search(r'\+git[^+]*\+([0-9a-f]{7,40})', value)
+                if srcrev_res is not None:
+                    srcrev = srcrev_res.group(1)
+                else:
+                    srcrev = ''
             elif key == "RECIPE NAME":
                 entries += 1
                 if value not in global_values.recipes_dict.keys():
                     global_values.recipes_dict[value] = ver
+                    if srcrev != '':
+                        global_values.recipe_srcrev_dict[value] = srcrev
     if entries == 0:
         return False
     logging.info("	Identified {} recipes from {} packages".format(len(global_values.recipes_dict), entries))
@@ -87,6 +105,35 @@ def proc_layers_in_recipes():
     logging.info("	Discovered {} layers".format(len(global_values.layers_list)))
 
 
+# Directory listings reused while the directory is unchanged (repeated scans in watch mode)
+glob_cache = {}
+
+
+def glob_dir(pattern):
+    try:
+        mtime = os.stat(os.path.dirname(pattern)).st_mtime_ns
+    except OSError:
+        return []
+    if pattern in glob_cache and glob_cache[pattern][0] == mtime:
+        return glob_cache[pattern][1]
+    paths = glob.glob(pattern)
+    glob_cache[pattern] = (mtime, paths)
+    return paths
+
+
+def proc_spdx_recipes():
+    global_values.spdx_sources, spdx_layers = spdx.get_recipe_sources(list(global_values.recipes_dict.keys()))
+    for recipe, layer in spdx_layers.items():
+        global_values.recipe_layer_dict[recipe] = layer
+        if layer not in global_values.layers_list:
+            global_values.layers_list.append(layer)
+
+
+def add_pkg_file(files_list, path, recipe):
+    files_list.append(path)
+    global_values.pkg_recipe_dict[path] = recipe
+
+
 def proc_pkg_files():
     if global_values.download_dir == '':
         logging.error('Download dir empty - cannot continue\n')
@@ -94,23 +141,35 @@ def proc_pkg_files():
     files_to_copy = []
     files_to_expand = []
 
-    # Get list of all download files
-    pattern = f"{global_values.download_dir}/*"
-    # print(pattern)
-    all_download_paths_list = glob.glob(pattern, recursive=True)
     download_paths_list = []
     download_files_list = []
-    for path in all_download_paths_list:
-        if not path.endswith(".done"):
-            download_paths_list.append(path)
-            download_files_list.append(os.path.basename(path))
-
-    # Get list of all package files
-    pattern = f"{global_values.pkg_dir}/**/*.{global_values.image_pkgtype}"
-    package_paths_list = glob.glob(pattern, recursive=True)
+    git_mirror_paths_list = []
+    pkg_index = {}
+    unindexed_paths_list = []
     package_files_list = []
-    for path in package_paths_list:
-        package_files_list.append(os.path.basename(path))
+
+    # Folders are only listed when some recipes could not be resolved from their SPDX documents
+    if any(recipe not in global_values.spdx_sources.keys() for recipe in global_values.recipes_dict.keys()):
+        # Get list of all download files
+        pattern = f"{global_values.download_dir}/*"
+        # print(pattern)
+        all_download_paths_list = glob_dir(pattern)
+        for path in all_download_paths_list:
+            if not path.endswith(".done"):
+                download_paths_list.append(path)
+                download_files_list.append(os.path.basename(path))
+
+        # Get list of all git mirrors
+        pattern = f"{global_values.download_dir}/git2/*"
+        git_mirror_paths_list = [path for path in glob_dir(pattern) if utils.is_git_repo(path)]
+
+        # Get list of all package files
+        pattern = f"{global_values.pkg_dir}/**/*.{global_values.image_pkgtype}"
+        package_paths_list = glob.glob(pattern, recursive=True)
+        # Map package files to recipes using package metadata, only using filename matching for unindexed packages
+        pkg_index, unindexed_paths_list = pkgindex.get_pkg_index(package_paths_list)
+        for path in unindexed_paths_list:
+            package_files_list.append(os.path.basename(path))
 
     for recipe in global_values.recipes_dict.keys():
         found = False
@@ -126,6 +185,18 @@ def proc_pkg_files():
                 global_values.recipe_layer_dict[recipe] in global_values.exclude_layers:
             continue
 
+        if recipe in global_values.spdx_sources.keys():
+            for path, commit in global_values.spdx_sources[recipe]:
+                if commit != '':
+                    global_values.git_mirror_revs[path] = commit
+                if len(global_values.extended_scan_layers) > 0 and \
+                        global_values.recipe_layer_dict[recipe] in global_values.extended_scan_layers:
+                    add_pkg_file(files_to_expand, path, recipe)
+                else:
+                    add_pkg_file(files_to_copy, path, recipe)
+                logging.info(f"- Recipe:{recipe}/{ver} - Located SPDX download: {path}")
+            continue
+
         recipe_esc = re.escape(recipe)
         ver_esc = re.escape(ver)
         download_regex = re.compile(f"^{recipe_esc}[_-]v?{ver_esc}[.-].*$")
@@ -137,22 +208,43 @@ def proc_pkg_files():
             if download_res is not None:
                 if len(global_values.extended_scan_layers) > 0 and \
                         global_values.recipe_layer_dict[recipe] in global_values.extended_scan_layers:
-                    files_to_expand.append(path)
+                    add_pkg_file(files_to_expand, path, recipe)
                 else:
-                    files_to_copy.append(path)
+                    add_pkg_file(files_to_copy, path, recipe)
                 found = True
                 logging.info(f"- Recipe:{recipe}/{ver} - Located package file: {path}")
         if found:
             continue
 
-        for path, file in zip(package_paths_list, package_files_list):
+        if recipe in global_values.recipe_srcrev_dict.keys():
+            path, commit = find_git_mirror(recipe, global_values.recipe_srcrev_dict[recipe], git_mirror_paths_list)
+            if path != '':
+                global_values.git_mirror_revs[path] = commit
+                if len(global_values.extended_scan_layers) > 0 and \
+                        global_values.recipe_layer_dict[recipe] in global_values.extended_scan_layers:
+                    add_pkg_file(files_to_expand, path, recipe)
+                else:
+                    add_pkg_file(files_to_copy, path, recipe)
+                logging.info(f"- Recipe:{recipe}/{ver} - Located git mirror: {path} (commit {commit})")
+                continue
+
+        if recipe in pkg_index.keys():
+            for path, pkgver, name in pkg_index[recipe]:
+                if pkgindex.match_version(pkgver, ver) and pkgindex.is_image_pkg(name):
+                    add_pkg_file(files_to_copy, path, recipe)
+                    logging.info(f"- Recipe:{recipe}/{ver} - Located package file: {path}")
+                    found = True
+            if found:
+                continue
+
+        for path, file in zip(unindexed_paths_list, package_files_list):
             if global_values.pkg_dir != '':
                 # pattern = f"{os.path.join(global_values.pkg_dir, global_values.machine)}/" \
                 #           f"{recipe}[-_]{ver}-*.{global_values.image_pkgtype}"
                 pkg_res = pkg_regex.match(file)
 
                 if pkg_res is not None:
-                    files_to_copy.append(path)
+                    add_pkg_file(files_to_copy, path, recipe)
                     logging.info(f"- Recipe:{recipe}/{ver} - Located package file: {path}")
                     found = True
 
@@ -163,16 +255,46 @@ def proc_pkg_files():
     return files_to_copy, files_to_expand
 
 
-def copy_pkg_files(pkgs, tmpdir):
+def find_git_mirror(recipe, srcrev, git_mirror_paths_list):
+    for path in git_mirror_paths_list:
+        name = os.path.basename(path)
+        if name.endswith('.git'):
+            name = name[:-4]
+        if name != recipe and not name.endswith(f".{recipe}"):
+            continue
+        commit = utils.get_git_commit(path, srcrev)
+        if commit != '':
+            return path, commit
+    return '', ''
+
+
+def get_git_mirror_commit(pkg):
+    if pkg in global_values.git_mirror_revs.keys():
+        return global_values.git_mirror_revs[pkg]
+    return utils.get_git_commit(pkg)
+
+
+def copy_pkg_file(pkg, tmpdir):
     import shutil
 
+    if utils.is_git_repo(pkg):
+        # Only stage a snapshot of the required commit rather than the full repository history
+        commit = get_git_mirror_commit(pkg)
+        if commit != '':
+            if utils.git_archive(pkg, commit, tmpdir, False):
+                return
+            logging.warning(f"- Staging full git repository {pkg}")
+    if os.path.isdir(pkg):
+        shutil.copytree(pkg, tmpdir, ignore_dangling_symlinks=True, dirs_exist_ok=True)
+    else:
+        shutil.copy(pkg, tmpdir)
+
+
+def copy_pkg_files(pkgs, tmpdir):
     # print(temppkgdir)
     count = 0
     for pkg in pkgs:
-        if os.path.isdir(pkg):
-            shutil.copytree(pkg, tmpdir, ignore_dangling_symlinks=True, dirs_exist_ok=True)
-        else:
-            shutil.copy(pkg, tmpdir)
+        copy_pkg_file(pkg, tmpdir)
         count += 1
 
     logging.info(f"Copying recipe package files")
@@ -180,52 +302,94 @@ def copy_pkg_files(pkgs, tmpdir):
     return count
 
 
-def expand_pkg_files(pkgs, tmpdir):
-    # import shutil
+def expand_pkg_file(pkg_path, tmpdir):
+    import shutil
     import tarfile
 
+    # Use the unpacked and patched sources from the build where available
+    if workdir.stage_source(pkg_path, tmpdir):
+        return
+
+    if utils.is_git_repo(pkg_path):
+        commit = get_git_mirror_commit(pkg_path)
+        if commit != '' and utils.git_archive(pkg_path, commit, tmpdir, True):
+            return
+        # Git repositories cannot be extracted so stage the full repository instead
+        logging.warning(f"- Staging full git repository {pkg_path}")
+        shutil.copytree(pkg_path, tmpdir, ignore_dangling_symlinks=True, dirs_exist_ok=True)
+        return
+
+    pkg_file = os.path.basename(pkg_path)
+    pkg_name = pkg_file.split('.')[0]
+    extract_dir = os.path.join(tmpdir, pkg_name)
+    if not os.path.isdir(extract_dir):
+        os.mkdir(extract_dir)
+    with tarfile.open(pkg_path, 'r|*') as tfile:
+        srcfilter.extract_tar(tfile, extract_dir)
+
+
+def expand_pkg_files(pkgs, tmpdir):
     # print(temppkgdir)
+    srcfilter.reset_skipped()
+    workdir.reset_staged()
     count = 0
     for pkg_path in pkgs:
-        pkg_file = os.path.basename(pkg_path)
-        pkg_name = pkg_file.split('.')[0]
-        extract_dir = os.path.join(tmpdir, pkg_name)
-        if not os.path.isdir(extract_dir):
-            os.mkdir(extract_dir)
-        tfile = tarfile.open(pkg_path)
-        tfile.extractall(extract_dir)
+        expand_pkg_file(pkg_path, tmpdir)
         count += 1
 
     logging.info(f"- Extracted {count} package files ...")
+    workdir.log_staged()
+    srcfilter.log_skipped()
     return count
 
 
-def proc_yocto_project(manfile):
-    import tempfile
-    logging.info('----------------------------------   PHASE 2  ----------------------------------')
-    try:
-        i = open(manfile, "r")
-    except Exception as e:
-        logging.error(f'Unable to open input manifest file {manfile}\n' + str(e))
-        sys.exit(3)
-
-    try:
-        liclines = i.readlines()
-        i.close()
-    except Exception as e:
-        logging.error(f'Unable to read license.manifest file {manfile} \n' + str(e))
-        sys.exit(3)
+def wait_for_bitbake_scan(bitbake_future):
+    if bitbake_future is not None and not bitbake_future.done():
+        logging.info("Waiting for Detect Bitbake scan to complete ...")
+    if bitbake_future is not None:
+        # Re-raises any exception (including sys.exit()) from the Bitbake scan thread
+        bitbake_future.result()
 
-    logging.info("Processing Bitbake project:")
-    if not proc_license_manifest(liclines):
-        sys.exit(3)
 
-    logging.info('----------------------------------   PHASE 3  ----------------------------------')
-    if len(global_values.extended_scan_layers) > 0 or len(global_values.exclude_layers) > 0:
-        logging.debug("Processing layers due to extended_scan_layers or excluded_layers specified ")
-        proc_layers_in_recipes()
+def proc_yocto_project(manfile, executor):
+    import tempfile
+    logging.info('----------------------------------   PHASE 2  ----------------------------------')
+    if checkpoint.is_done('recipes'):
+        logging.info("Reusing recipes and layers from resumed run ...")
+        restore_recipes(checkpoint.get('recipes'))
     else:
-        logging.info('Skipping layer processing ...')
+        try:
+            i = open(manfile, "r")
+        except Exception as e:
+            logging.error(f'Unable to open input manifest file {manfile}\n' + str(e))
+            sys.exit(3)
+
+        try:
+            liclines = i.readlines()
+            i.close()
+        except Exception as e:
+            logging.error(f'Unable to read license.manifest file {manfile} \n' + str(e))
+            sys.exit(3)
+
+        logging.info("Processing Bitbake project:")
+        if not proc_license_manifest(liclines):
+            sys.exit(3)
+
+        logging.info('----------------------------------   PHASE 3  ----------------------------------')
+        if len(global_values.spdx_locations) > 0:
+            logging.info("Processing recipe SPDX documents ...")
+            proc_spdx_recipes()
+        if len(global_values.extended_scan_layers) > 0 or len(global_values.exclude_layers) > 0 or \
+                len(global_values.layer_profiles) > 0:
+            if all(recipe in global_values.recipe_layer_dict.keys() for recipe in global_values.recipes_dict.keys()):
+                logging.info('Layers identified for all recipes from SPDX documents')
+            else:
+                logging.debug("Processing layers due to extended_scan_layers, excluded_layers or layer_profiles "
+                              "specified ")
+                proc_layers_in_recipes()
+        else:
+            logging.info('Skipping layer processing ...')
+        checkpoint.complete('recipes', get_recipes_state())
 
     # proc_recipe_revisions()
     # if not config.args.no_kb_check:
@@ -233,28 +397,431 @@ def proc_yocto_project(manfile):
     # proc_layers()
     # proc_recipes()
 
-    logging.info('----------------------------------   PHASE 4  ----------------------------------')
-    logging.info("Processing recipe & package files ...")
-    pkg_copy_list, pkg_expand_list = proc_pkg_files()
-    temppkgdir = tempfile.mkdtemp(prefix="bd_sig_pkgs")
+    # Detect Bitbake scan runs in the background while package files are staged - it is started after
+    # Phase 3 as bitbake-layers and the Detect Bitbake scan cannot use the bitbake server concurrently
+    logging.info('----------------------------------   PHASE 1  ----------------------------------')
+    global_values.api_phase = 'scan'
+    bitbake_future = None
+    if global_values.skip_detect_for_bitbake:
+        logging.info('Skipping Detect BITBAKE scan ...')
+    elif checkpoint.is_done('bitbake'):
+        logging.info('Detect BITBAKE scan completed in resumed run - skipping ...')
+    else:
+        bitbake_future = executor.submit(run_bitbake_scan)
+
+    if checkpoint.is_done('sigscan'):
+        logging.info('----------------------------------   PHASE 5  ----------------------------------')
+        logging.info('Signature scan completed in resumed run - skipping ...')
+        wait_for_bitbake_scan(bitbake_future)
+    else:
+        logging.info('----------------------------------   PHASE 4  ----------------------------------')
+        logging.info("Processing recipe & package files ...")
+        if checkpoint.is_done('pkgfiles'):
+            logging.info("Reusing package file lists from resumed run ...")
+            pkgfiles = checkpoint.get('pkgfiles')
+            pkg_copy_list, pkg_expand_list = pkgfiles['copy'], pkgfiles['expand']
+            global_values.git_mirror_revs = pkgfiles['git_mirror_revs']
+            global_values.pkg_recipe_dict = pkgfiles.get('pkg_recipe_dict', {})
+        else:
+            pkg_copy_list, pkg_expand_list = proc_pkg_files()
+            checkpoint.complete('pkgfiles', {
+                'copy': pkg_copy_list,
+                'expand': pkg_expand_list,
+                'git_mirror_revs': global_values.git_mirror_revs,
+                'pkg_recipe_dict': global_values.pkg_recipe_dict,
+            })
+
+        if len(global_values.layer_profiles) > 0:
+            logging.info('----------------------------------   PHASE 5  ----------------------------------')
+            logging.info("Running Synopsys Detect on recipes using layer scan profiles ...")
+            wait_for_bitbake_scan(bitbake_future)
+            run_profile_sigscans(pkg_copy_list, pkg_expand_list, config.args.project, config.args.version)
+        elif global_values.sigscan_cache:
+            logging.info('----------------------------------   PHASE 5  ----------------------------------')
+            logging.info("Running cached Synopsys Detect Signature scans on recipes ...")
+            run_cached_sigscan(pkg_copy_list, pkg_expand_list, config.args.project, config.args.version,
+                               bitbake_future)
+        elif global_values.staging_dir != '':
+            logging.info("Synchronizing persistent staging folder ...")
+            sync_staging_dir(pkg_copy_list, pkg_expand_list, global_values.staging_dir)
+            wait_for_bitbake_scan(bitbake_future)
+
+            logging.info('----------------------------------   PHASE 5  ----------------------------------')
+            logging.info("Running Synopsys Detect on recipes ...")
+
+            bd_scan_process.run_detect_sigscan(global_values.staging_dir, config.args.project, config.args.version,
+                                               config.args.blackduck_trust_cert, keep=True)
+        elif global_values.max_stage_size > 0:
+            logging.info('----------------------------------   PHASE 5  ----------------------------------')
+            logging.info("Staging and running Synopsys Detect on recipes in waves ...")
+            wait_for_bitbake_scan(bitbake_future)
+            run_wave_sigscan(pkg_copy_list, pkg_expand_list, config.args.project, config.args.version)
+        else:
+            temppkgdir = tempfile.mkdtemp(prefix="bd_sig_pkgs")
+
+            processed_files = 0
+            if len(pkg_copy_list) > 0:
+                processed_files += copy_pkg_files(pkg_copy_list, temppkgdir)
+            if len(pkg_expand_list) > 0:
+                processed_files += expand_pkg_files(pkg_expand_list, temppkgdir)
+            wait_for_bitbake_scan(bitbake_future)
 
-    processed_files = 0
-    if len(pkg_copy_list) > 0:
-        processed_files += copy_pkg_files(pkg_copy_list, temppkgdir)
-    if len(pkg_expand_list) > 0:
-        processed_files += expand_pkg_files(pkg_expand_list, temppkgdir)
+            logging.info('----------------------------------   PHASE 5  ----------------------------------')
+            logging.info("Running Synopsys Detect on recipes ...")
 
-    logging.info('----------------------------------   PHASE 5  ----------------------------------')
-    logging.info("Running Synopsys Detect on recipes ...")
+            bd_scan_process.run_detect_sigscan(temppkgdir, config.args.project, config.args.version,
+                                               config.args.blackduck_trust_cert)
 
-    bd_scan_process.run_detect_sigscan(temppkgdir, config.args.project, config.args.version,
-                                       config.args.blackduck_trust_cert)
+        if global_values.binary_cache:
+            binary_pkgs = [pkg for pkg in pkg_copy_list + pkg_expand_list if get_pkg_profile(pkg)[1]]
+            if len(binary_pkgs) > 0:
+                logging.info("Running BDBA binary scans on changed package files ...")
+                bincache.run_binary_scans(global_values.bd, binary_pkgs, config.args.project,
+                                          config.args.version)
+        checkpoint.complete('sigscan')
 
     logging.info('----------------------------------   PHASE 6  ----------------------------------')
+    global_values.api_phase = '6'
+    from bd_scan_yocto import bd_process_bom
     bd_process_bom.process_bdproject(config.args.project, config.args.version)
 
 
+def run_bitbake_scan():
+    bd_scan_process.run_detect_for_bitbake()
+    checkpoint.complete('bitbake')
+
+
+def get_recipes_state():
+    return {
+        'packages_list': global_values.packages_list,
+        'recipes_dict': global_values.recipes_dict,
+        'recipe_layer_dict': global_values.recipe_layer_dict,
+        'recipe_srcrev_dict': global_values.recipe_srcrev_dict,
+        'layers_list': global_values.layers_list,
+        'spdx_sources': global_values.spdx_sources,
+    }
+
+
+def restore_recipes(recipes):
+    global_values.packages_list = recipes['packages_list']
+    global_values.recipes_dict = recipes['recipes_dict']
+    global_values.recipe_layer_dict = recipes['recipe_layer_dict']
+    global_values.recipe_srcrev_dict = recipes['recipe_srcrev_dict']
+    global_values.layers_list = recipes['layers_list']
+    global_values.spdx_sources = recipes.get('spdx_sources', {})
+
+
+def get_stage_entry(pkg, expand):
+    st = os.stat(pkg)
+    entry = {
+        'src': pkg,
+        'size': st.st_size,
+        'mtime': st.st_mtime,
+    }
+    if utils.is_git_repo(pkg):
+        entry['commit'] = get_git_mirror_commit(pkg)
+    if expand:
+        sdir = workdir.get_pkg_source(pkg)
+        if sdir != '':
+            # Bitbake unpacks the sources again when a recipe is rebuilt
+            entry['workdir'] = [sdir, os.stat(sdir).st_mtime]
+        entry['filter'] = srcfilter.get_filter_settings()
+    return entry
+
+
+def sync_staging_dir(pkg_copy_list, pkg_expand_list, stagedir):
+    import json
+    import shutil
+
+    # The manifest is kept beside the staging folder so it is not included in the scan
+    manifest_file = stagedir.rstrip('/') + '.json'
+    manifest = {}
+    if os.path.isfile(manifest_file):
+        try:
+            with open(manifest_file, 'r') as f:
+                manifest = json.load(f)
+        except Exception as e:
+            logging.warning(f"Unable to read staging manifest {manifest_file} - restaging all files\n" + str(e))
+
+    srcfilter.reset_skipped()
+    new_manifest = {}
+    added = 0
+    unchanged = 0
+    pkgs = [(pkg, False) for pkg in pkg_copy_list] + [(pkg, True) for pkg in pkg_expand_list]
+    for pkg, expand in pkgs:
+        name = os.path.basename(pkg.rstrip('/'))
+        if expand:
+            name += '.expanded'
+        entry = get_stage_entry(pkg, expand)
+        pkgdir = os.path.join(stagedir, name)
+        if name in new_manifest.keys():
+            logging.warning(f"Duplicate package file name {name} - skipping {pkg}")
+            continue
+        new_manifest[name] = entry
+        if manifest.get(name) == entry and os.path.isdir(pkgdir):
+            unchanged += 1
+            continue
+
+        if os.path.isdir(pkgdir):
+            shutil.rmtree(pkgdir)
+        os.makedirs(pkgdir)
+        if expand:
+            expand_pkg_file(pkg, pkgdir)
+        else:
+            copy_pkg_file(pkg, pkgdir)
+        added += 1
+
+    # Remove stale package files (and anything else not staged by this process)
+    removed = 0
+    for name in os.listdir(stagedir):
+        path = os.path.join(stagedir, name)
+        if name in new_manifest.keys():
+            continue
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+        removed += 1
+
+    with open(manifest_file, 'w') as f:
+        json.dump(new_manifest, f, indent=1)
+
+    logging.info(f"- Staged {added} new or changed package files, removed {removed} stale package files, "
+                 f"{unchanged} unchanged")
+    srcfilter.log_skipped()
+
+
+def get_path_size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.lstat(os.path.join(root, file)).st_size
+            except OSError:
+                continue
+    return size
+
+
+def run_wave_sigscan(pkg_copy_list, pkg_expand_list, proj, ver):
+    import tempfile
+
+    srcfilter.reset_skipped()
+    pkgs = [(pkg, False) for pkg in pkg_copy_list] + [(pkg, True) for pkg in pkg_expand_list]
+    wave = 1
+    wavedir = tempfile.mkdtemp(prefix="bd_sig_pkgs")
+    staged_size = 0
+    staged_count = 0
+    for index, (pkg, expand) in enumerate(pkgs):
+        # Scan the current wave first if copying this package would exceed the disk budget
+        if not expand and staged_count > 0 and not utils.is_git_repo(pkg) and \
+                staged_size + get_path_size(pkg) > global_values.max_stage_size:
+            scan_wave(wavedir, wave, staged_count, staged_size, proj, ver)
+            wave += 1
+            wavedir = tempfile.mkdtemp(prefix="bd_sig_pkgs")
+            staged_size = 0
+            staged_count = 0
+
+        pkgdir = os.path.join(wavedir, str(index))
+        os.mkdir(pkgdir)
+        if expand:
+            expand_pkg_file(pkg, pkgdir)
+        else:
+            copy_pkg_file(pkg, pkgdir)
+        staged_size += get_path_size(pkgdir)
+        staged_count += 1
+
+        if staged_size >= global_values.max_stage_size:
+            scan_wave(wavedir, wave, staged_count, staged_size, proj, ver)
+            wave += 1
+            wavedir = tempfile.mkdtemp(prefix="bd_sig_pkgs")
+            staged_size = 0
+            staged_count = 0
+
+    if staged_count > 0 or wave == 1:
+        scan_wave(wavedir, wave, staged_count, staged_size, proj, ver)
+    else:
+        os.rmdir(wavedir)
+        wave -= 1
+    srcfilter.log_skipped()
+
+    # Previous runs may have used more waves
+    removed = utils.remove_codelocations(global_values.bd, proj, ver, get_wave_codelocation(proj, ver, ''),
+                                         [get_wave_codelocation(proj, ver, index) for index in range(1, wave + 1)])
+    if removed > 0:
+        logging.info(f"- Removed {removed} code locations for waves from previous runs")
+
+
+def get_wave_codelocation(proj, ver, wave):
+    return f"{proj}/{ver}/bd_scan_yocto/wave{wave}"
+
+
+def scan_wave(wavedir, wave, staged_count, staged_size, proj, ver):
+    logging.info(f"- Scanning wave {wave} - {staged_count} package files ({staged_size / (1024 * 1024):.1f} MB)")
+    # Use a fixed code location name per wave so that all waves are retained in the project version
+    bd_scan_process.run_detect_sigscan(wavedir, proj, ver, config.args.blackduck_trust_cert,
+                                       codelocation=get_wave_codelocation(proj, ver, wave))
+
+
+def get_pkg_profile(pkg):
+    # Layers without a profile use the global --snippets and --binary_scan options
+    layer = global_values.recipe_layer_dict.get(global_values.pkg_recipe_dict.get(pkg, ''), '')
+    if layer in global_values.layer_profiles.keys():
+        return global_values.layer_profiles[layer]
+    return global_values.snippets, global_values.binary_scan
+
+
+def get_profile_name(profile):
+    snippets, binary = profile
+    return 'signature' + ('+snippets' if snippets else '') + ('+binary' if binary else '')
+
+
+def run_profile_sigscans(pkg_copy_list, pkg_expand_list, proj, ver):
+    import tempfile
+
+    profiles = {}
+    for pkg in pkg_copy_list:
+        profiles.setdefault(get_pkg_profile(pkg), ([], []))[0].append(pkg)
+    for pkg in pkg_expand_list:
+        profiles.setdefault(get_pkg_profile(pkg), ([], []))[1].append(pkg)
+
+    # Each profile is staged and scanned separately so snippet and binary scanning only apply to its packages
+    for profile, (copy_list, expand_list) in sorted(profiles.items()):
+        name = get_profile_name(profile)
+        logging.info(f"- Scanning {len(copy_list) + len(expand_list)} package files with profile '{name}'")
+        tdir = tempfile.mkdtemp(prefix="bd_sig_pkgs")
+        if len(copy_list) > 0:
+            copy_pkg_files(copy_list, tdir)
+        if len(expand_list) > 0:
+            expand_pkg_files(expand_list, tdir)
+        bd_scan_process.run_detect_sigscan(tdir, proj, ver, config.args.blackduck_trust_cert,
+                                           codelocation=get_profile_codelocation(proj, ver, name),
+                                           snippets=profile[0], binary=profile[1])
+
+    # Profiles used by previous runs may no longer apply to any package files
+    removed = utils.remove_codelocations(global_values.bd, proj, ver, get_profile_codelocation(proj, ver, 'signature'),
+                                         [get_profile_codelocation(proj, ver, get_profile_name(profile))
+                                          for profile in profiles.keys()])
+    if removed > 0:
+        logging.info(f"- Removed {removed} code locations for scan profiles from previous runs")
+
+
+def get_profile_codelocation(proj, ver, name):
+    return f"{proj}/{ver}/bd_scan_yocto/{name}"
+
+
+def get_cached_codelocation(proj, ver, name):
+    return f"{proj}/{ver}/bd_scan_yocto/pkg/{name}"
+
+
+def run_cached_sigscan(pkg_copy_list, pkg_expand_list, proj, ver, bitbake_future=None):
+    import shutil
+    import tempfile
+
+    if global_values.binary_scan and not global_values.binary_cache:
+        logging.warning("Binary scan is not supported with --sigscan_cache and --no_binary_cache - "
+                        "skipping binary scan")
+
+    cmd = bd_scan_process.get_detect()
+    srcfilter.reset_skipped()
+    pkgs = [(pkg, False) for pkg in pkg_copy_list] + [(pkg, True) for pkg in pkg_expand_list]
+    index = sigcache.load_hash_index()
+    scans = []
+    cached_count = 0
+    scanned_count = 0
+    for pkg, expand in pkgs:
+        key = sigcache.get_pkg_key(index, pkg, expand)
+        pkg_scans = sigcache.lookup(key)
+        if pkg_scans is not None:
+            logging.debug(f"- Using cached Signature scan for {pkg}")
+            cached_count += 1
+        else:
+            logging.info(f"- Signature scanning {pkg} ...")
+            stagedir = tempfile.mkdtemp(prefix="bd_sig_pkg")
+            outdir = tempfile.mkdtemp(prefix="bd_sig_out")
+            if expand:
+                expand_pkg_file(pkg, stagedir)
+            else:
+                copy_pkg_file(pkg, stagedir)
+            if bd_scan_process.run_detect_dryrun_sigscan(cmd, stagedir, outdir, proj, ver):
+                pkg_scans = sigcache.store(key, outdir)
+            if not global_values.testmode:
+                shutil.rmtree(stagedir)
+                shutil.rmtree(outdir)
+            if pkg_scans is None:
+                logging.error(f"Unable to Signature scan package file {pkg}")
+                sys.exit(2)
+            scanned_count += 1
+        for index, scan in enumerate(pkg_scans):
+            scans.append((scan, get_cached_codelocation(proj, ver, f"{os.path.basename(pkg)}/{index}")))
+
+    sigcache.save_hash_index(index)
+    logging.info(f"- Reused {cached_count} cached Signature scans, scanned {scanned_count} changed package files")
+    srcfilter.log_skipped()
+
+    wait_for_bitbake_scan(bitbake_future)
+    logging.info(f"- Uploading {len(scans)} Signature scans ...")
+    for scan, name in scans:
+        if not sigcache.upload(global_values.bd, scan, proj, ver, name):
+            sys.exit(2)
+
+    logging.info("- Waiting for project version BOM to complete ...")
+    bdproj, bdver = utils.get_projver(global_values.bd, config.args)
+    count = 1
+    while bdver is None:
+        time.sleep(10)
+        bdproj, bdver = utils.get_projver(global_values.bd, config.args)
+        count += 1
+        if count > 20:
+            logging.error(f"Unable to locate project {proj} and version '{ver}' - terminating")
+            sys.exit(2)
+
+    # Package files scanned by previous runs may no longer be in the build
+    removed = utils.remove_codelocations(global_values.bd, proj, ver, get_cached_codelocation(proj, ver, ''),
+                                         [name for scan, name in scans])
+    if removed > 0:
+        logging.info(f"- Removed {removed} code locations for package files from previous runs")
+
+    if not utils.wait_for_bom_completion(global_values.bd, bdver):
+        logging.warning("Project version BOM did not complete - continuing")
+    return
+
+
+def proc_cve_file(cve_check_file):
+    try:
+        cvefile = open(cve_check_file, "r")
+        cvelines = cvefile.readlines()
+        cvefile.close()
+    except Exception as e:
+        logging.error("Unable to open CVE check output file\n" + str(e))
+        sys.exit(3)
+
+    patched_vulns = []
+    pkgvuln = {}
+    for line in cvelines:
+        arr = line.split(":")
+        if len(arr) > 1:
+            key = arr[0]
+            value = arr[1].strip()
+            if key == "PACKAGE NAME":
+                pkgvuln['package'] = value
+            elif key == "PACKAGE VERSION":
+                pkgvuln['version'] = value
+            elif key == "CVE":
+                pkgvuln['CVE'] = value
+            elif key == "CVE STATUS":
+                pkgvuln['status'] = value
+                if pkgvuln['status'] == "Patched":
+                    patched_vulns.append((pkgvuln['package'], pkgvuln['CVE']))
+                pkgvuln = {}
+
+    return patched_vulns
+
+
 def process_patched_cves(bd, version, vuln_list):
+    vuln_set = set(vuln_list)
+    bdsa_cves = {}
     try:
         # headers = {'Accept': 'application/vnd.blackducksoftware.bill-of-materials-6+json'}
         # resp = bd.get_json(version['_meta']['href'] + '/vulnerable-bom-components?limit=5000', headers=headers)
@@ -262,29 +829,51 @@ def process_patched_cves(bd, version, vuln_list):
 
         count = 0
 
-        for comp in items:
-            if comp['vulnerabilityWithRemediation']['source'] == "NVD":
-                if comp['vulnerabilityWithRemediation']['vulnerabilityName'] in vuln_list:
-                    if utils.patch_vuln(bd, comp):
-                        print("		Patched {}".format(comp['vulnerabilityWithRemediation']['vulnerabilityName']))
-                        count += 1
-            elif comp['vulnerabilityWithRemediation']['source'] == "BDSA":
-                vuln_url = "/api/vulnerabilities/" + comp['vulnerabilityWithRemediation'][
-                    'vulnerabilityName']
-                # custom_headers = {'Accept': 'application/vnd.blackducksoftware.vulnerability-4+json'}
-                # resp = hub.execute_get(vuln_url, custom_headers=custom_headers)
-                vuln = bd.get_json(vuln_url)
-                # vuln = resp.json()
-                # print(json.dumps(vuln, indent=4))
-                for x in vuln['_meta']['links']:
-                    if x['rel'] == 'related-vulnerability':
-                        if x['label'] == 'NVD':
-                            cve = x['href'].split("/")[-1]
-                            if cve in vuln_list:
-                                if utils.patch_vuln(bd, comp):
-                                    print("		Patched " + vuln['name'] + ": " + cve)
-                                    count += 1
-                        break
+        # Vulnerabilities already patched in a resumed run are not updated again
+        patched_hrefs = checkpoint.get('cves').get('patched', [])
+        done = set(patched_hrefs)
+        if len(done) > 0:
+            logging.info(f"- Skipping {len(done)} CVEs patched in resumed run")
+
+        # Remediation updates are sent over the shared async session as soon as each vulnerability matches,
+        # overlapping the remaining page downloads and BDSA lookups
+        from bd_scan_yocto import asyncclient
+        client = asyncclient.get_client()
+        patch_list = []
+        already_count = 0
+        for vuln in items:
+            # Only send updates where the remediation status differs (this also skips the BDSA lookup)
+            if vuln.status == "PATCHED":
+                already_count += 1
+                continue
+            if vuln.href in done:
+                continue
+            name = ''
+            if vuln.source == "NVD":
+                if vuln.name in vuln_set:
+                    name = vuln.name
+            elif vuln.source == "BDSA":
+                # The same BDSA is reported against multiple components so only look up related CVE once
+                if vuln.name not in bdsa_cves.keys():
+                    bdsa_cves[vuln.name] = get_bdsa_cve(bd, vuln.name)
+                cve = bdsa_cves[vuln.name]
+                if cve in vuln_set:
+                    name = vuln.name + ": " + cve
+            if name != '':
+                patch_list.append((vuln.href, name, client.submit(utils.async_patch_vuln(client, vuln.href))))
+
+        if already_count > 0:
+            logging.info(f"- Skipping {already_count} vulnerabilities already marked as patched")
+
+        failed = False
+        for href, name, future in patch_list:
+            if future.result():
+                print("		Patched " + name)
+                patched_hrefs.append(href)
+                count += 1
+            else:
+                failed = True
+        checkpoint.update('cves', {'patched': patched_hrefs}, not failed)
 
     except Exception as e:
         logging.error("Unable to get components from project via API\n" + str(e))
@@ -295,21 +884,53 @@ def process_patched_cves(bd, version, vuln_list):
     return True
 
 
+def get_bdsa_cve(bd, bdsa):
+    vuln_url = "/api/vulnerabilities/" + bdsa
+    # custom_headers = {'Accept': 'application/vnd.blackducksoftware.vulnerability-4+json'}
+    # resp = hub.execute_get(vuln_url, custom_headers=custom_headers)
+    vuln = bd.get_json(vuln_url)
+    for x in vuln['_meta']['links']:
+        if x['rel'] == 'related-vulnerability':
+            if x['label'] == 'NVD':
+                return x['href'].split("/")[-1]
+            break
+    return ''
+
+
+VulnRecord = collections.namedtuple('VulnRecord', ['name', 'source', 'href', 'status'])
+
+
+def get_vuln_record(comp):
+    vuln = comp['vulnerabilityWithRemediation']
+    return VulnRecord(vuln['vulnerabilityName'], vuln['source'], comp['_meta']['href'],
+                      vuln.get('remediationStatus', ''))
+
+
+def get_vuln_page(bd, url, headers):
+    return [get_vuln_record(comp) for comp in jsonstream.iter_items(bd, url, headers=headers)]
+
+
 def get_vulns(bd, version):
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
     bucket = 1000
     headers = {'Accept': 'application/vnd.blackducksoftware.bill-of-materials-6+json'}
     compurl = f"{version['_meta']['href']}/vulnerable-bom-components?limit={bucket}"
 
-    try:
-        resp = bd.get_json(compurl, headers=headers)
-        total = resp['totalCount']
-        alldata = resp['items']
-        offset = bucket
-        while len(alldata) < total:
-            resp = bd.get_json(f"{compurl}&offset={offset}", headers=headers)
-            alldata += resp['items']
-            offset += bucket
-    except Exception as e:
-        logging.error("Unable to get components from project via API\n" + str(e))
-        return None
-    return alldata
+    # Rows from the first page are yielded while the response is still being received
+    fields = {}
+    for comp in jsonstream.iter_items(bd, compurl, headers=headers, fields=fields):
+        yield get_vuln_record(comp)
+    total = fields['totalCount']
+
+    # Fetch remaining pages concurrently, yielding records from each page as soon as it arrives
+    offsets = list(range(bucket, total, bucket))
+    with ThreadPoolExecutor(max_workers=global_values.api_threads) as executor:
+        pending = set()
+        while len(offsets) > 0 or len(pending) > 0:
+            while len(offsets) > 0 and len(pending) < global_values.api_threads:
+                pending.add(executor.submit(get_vuln_page, bd, f"{compurl}&offset={offsets.pop(0)}", headers))
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                for vuln in future.result():
+                    yield vuln
@@ -0,0 +1,158 @@
+import time
+import logging
+import threading
+import requests
+
+from bd_scan_yocto import global_values
+
+# Responses which indicate the server is throttling requests
+THROTTLE_STATUS = [429, 503]
+
+stats = {
+    'requests': 0,
+    'throttled': 0,
+    'retried': 0,
+}
+
+
+class RateLimiter:
+    # Token bucket limiting the request rate and number of requests in flight, shared by the
+    # requests adapters and aiohttp requests
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tokens = 0.0
+        self.last = time.monotonic()
+        self.inflight = 0
+        self.blocked_until = 0.0
+
+    def try_acquire(self):
+        # Returns 0 when the request can be sent, otherwise the time to wait before trying again
+        with self.lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if 0 < global_values.api_max_inflight <= self.inflight:
+                return 0.05
+            if global_values.api_rate > 0:
+                burst = max(1.0, global_values.api_rate)
+                self.tokens = min(burst, self.tokens + (now - self.last) * global_values.api_rate)
+                self.last = now
+                if self.tokens < 1.0:
+                    return (1.0 - self.tokens) / global_values.api_rate
+                self.tokens -= 1.0
+            self.inflight += 1
+            stats['requests'] += 1
+            return 0
+
+    def acquire(self):
+        waited = False
+        while True:
+            delay = self.try_acquire()
+            if delay == 0:
+                break
+            waited = True
+            time.sleep(delay)
+        if waited:
+            add_stat('throttled')
+
+    async def aacquire(self):
+        import asyncio
+
+        waited = False
+        while True:
+            delay = self.try_acquire()
+            if delay == 0:
+                break
+            waited = True
+            await asyncio.sleep(delay)
+        if waited:
+            add_stat('throttled')
+
+    def release(self):
+        with self.lock:
+            self.inflight -= 1
+
+    def pause(self, retry_after, retries):
+        # Hold back all requests for the time requested by the server (or an increasing backoff)
+        delay = 2 ** retries
+        if retry_after is not None and retry_after.isdigit():
+            delay = int(retry_after)
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+        add_stat('retried')
+        logging.debug(f"Black Duck server throttled request - retrying in {delay} seconds")
+
+
+limiter = RateLimiter()
+
+
+def add_stat(name, value=1):
+    with limiter.lock:
+        stats[name] += value
+
+
+def log_stats():
+    if stats['throttled'] == 0 and stats['retried'] == 0:
+        return
+    logging.info(f"API rate limiting: {stats['requests']} requests, {stats['throttled']} delayed by the limiter, "
+                 f"{stats['retried']} retried after server throttling")
+
+
+def disable_throttle_retries(adapter):
+    # urllib3 would otherwise retry throttled requests itself without holding back other requests
+    while not isinstance(adapter, requests.adapters.HTTPAdapter):
+        adapter = getattr(adapter, 'adapter', None)
+        if adapter is None:
+            return
+    retry = adapter.max_retries
+    adapter.max_retries = retry.new(status_forcelist=[status for status in (retry.status_forcelist or [])
+                                                      if status not in THROTTLE_STATUS],
+                                    respect_retry_after_header=False)
+
+
+def install(session):
+    for prefix, adapter in list(session.adapters.items()):
+        if not isinstance(adapter, RateLimitAdapter):
+            disable_throttle_retries(adapter)
+            session.mount(prefix, RateLimitAdapter(adapter))
+
+
+class RateLimitAdapter(requests.adapters.BaseAdapter):
+    # Wraps the session transport adapter so every request passes through the shared limiter
+
+    def __init__(self, adapter):
+        super().__init__()
+        self.adapter = adapter
+
+    def send(self, request, **kwargs):
+        retries = 0
+        while True:
+            limiter.acquire()
+            try:
+                resp = self.adapter.send(request, **kwargs)
+            finally:
+                limiter.release()
+            if resp.status_code not in THROTTLE_STATUS or retries >= global_values.api_retries:
+                return resp
+            limiter.pause(resp.headers.get('Retry-After'), retries)
+            resp.close()
+            retries += 1
+
+    def close(self):
+        self.adapter.close()
+
+
+async def arequest(session, method, url, **kwargs):
+    retries = 0
+    while True:
+        await limiter.aacquire()
+        try:
+            resp = await session.request(method, url, **kwargs)
+        finally:
+            limiter.release()
+        if resp.status not in THROTTLE_STATUS or retries >= global_values.api_retries:
+            return resp
+        limiter.pause(resp.headers.get('Retry-After'), retries)
+        resp.release()
+        retries += 1
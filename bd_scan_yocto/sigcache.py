@@ -0,0 +1,161 @@
+import os
+import json
+import glob
+import shutil
+import hashlib
+import logging
+
+from bd_scan_yocto import global_values
+from bd_scan_yocto import srcfilter
+from bd_scan_yocto import workdir
+
+
+# Offline Signature scan (.json) files are uploaded as JSON-LD to the scan data endpoint
+# (as for Scans.upload_scan in the blackduck library and the Upload Scans option in the UI)
+scan_content_type = 'application/ld+json'
+
+
+def get_cache_dir():
+    cdir = os.path.join(global_values.cache_dir, 'sigscan')
+    if not os.path.isdir(cdir):
+        os.makedirs(cdir)
+    return cdir
+
+
+def hash_file(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def get_hash_index_file():
+    return os.path.join(global_values.cache_dir, 'hashindex.json')
+
+
+def load_hash_index():
+    index_file = get_hash_index_file()
+    if not os.path.isfile(index_file):
+        return {}
+    try:
+        with open(index_file, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        logging.warning(f"Unable to read file hash index {index_file} - {str(e)}")
+        return {}
+
+
+def save_hash_index(index):
+    index_file = get_hash_index_file()
+    try:
+        if not os.path.isdir(os.path.dirname(index_file)):
+            os.makedirs(os.path.dirname(index_file))
+        with open(index_file + '.tmp', 'w') as f:
+            json.dump(index, f)
+        os.replace(index_file + '.tmp', index_file)
+    except Exception as e:
+        logging.warning(f"Unable to write file hash index {index_file} - {str(e)}")
+
+
+def get_file_hash(index, path):
+    # Files are only hashed again when their size or modification time has changed
+    st = os.stat(path)
+    entry = index.get(path)
+    if entry is not None and entry['size'] == st.st_size and entry['mtime'] == int(st.st_mtime):
+        return entry['hash']
+    fhash = hash_file(path)
+    index[path] = {'size': st.st_size, 'mtime': int(st.st_mtime), 'hash': fhash}
+    return fhash
+
+
+def hash_dir(path):
+    # Hash folder layout and file stats rather than contents (folders can be very large)
+    sha = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file in sorted(files):
+            fpath = os.path.join(root, file)
+            try:
+                st = os.lstat(fpath)
+            except OSError:
+                continue
+            sha.update(f"{os.path.relpath(fpath, path)}:{st.st_size}:{int(st.st_mtime)}\n".encode('utf-8'))
+    return sha.hexdigest()
+
+
+def get_pkg_key(index, path, expand):
+    sdir = workdir.get_pkg_source(path) if expand else ''
+    if sdir != '':
+        # Patched sources from the build work folder
+        phash = 'workdir-' + hash_dir(sdir)
+    elif path in global_values.git_mirror_revs.keys():
+        # Git snapshots are identified by their commit
+        phash = global_values.git_mirror_revs[path]
+    elif os.path.isdir(path):
+        phash = hash_dir(path)
+    else:
+        phash = get_file_hash(index, path)
+
+    mode = 'expand' if expand else 'copy'
+    if expand:
+        # Scans of expanded archives depend on the extraction filter settings
+        settings = json.dumps(srcfilter.get_filter_settings())
+        mode += '-' + hashlib.sha256(settings.encode('utf-8')).hexdigest()[:12]
+    if global_values.snippets:
+        mode += '-snippet'
+    return f"{phash}-{mode}"
+
+
+def lookup(key):
+    kdir = os.path.join(get_cache_dir(), key)
+    if not os.path.isdir(kdir):
+        return None
+    scans = glob.glob(os.path.join(kdir, '*.json'))
+    if len(scans) == 0:
+        return None
+    return scans
+
+
+def store(key, outdir):
+    # Detect signature scanner dry run writes scan data as json files under the run folder
+    scans = glob.glob(os.path.join(outdir, 'runs', '*', 'scan', '**', '*.json'), recursive=True)
+    if len(scans) == 0:
+        return None
+
+    kdir = os.path.join(get_cache_dir(), key)
+    tmpdir = kdir + '.tmp'
+    if os.path.isdir(tmpdir):
+        shutil.rmtree(tmpdir)
+    os.makedirs(tmpdir)
+    cached = []
+    for index, scan in enumerate(scans):
+        cached.append(os.path.join(kdir, f"scan{index}.json"))
+        shutil.copy(scan, os.path.join(tmpdir, f"scan{index}.json"))
+    if os.path.isdir(kdir):
+        shutil.rmtree(kdir)
+    os.rename(tmpdir, kdir)
+    return cached
+
+
+def upload(bd, scanfile, proj, ver, name):
+    try:
+        with open(scanfile, 'r') as f:
+            scan = json.load(f)
+    except Exception as e:
+        logging.error(f"Unable to read cached scan file {scanfile}\n" + str(e))
+        return False
+
+    scan['project'] = proj
+    scan['release'] = ver
+    scan['name'] = name
+
+    try:
+        url = f"{global_values.bd_url}/api/scan/data/?mode=replace"
+        r = bd.session.post(url, data=json.dumps(scan), headers={'Content-Type': scan_content_type})
+        r.raise_for_status()
+    except Exception as e:
+        logging.error(f"Unable to upload scan {name}\n" + str(e))
+        return False
+
+    return True
@@ -0,0 +1,140 @@
+import os
+import glob
+import json
+import logging
+import tarfile
+from urllib.parse import urlparse
+
+from bd_scan_yocto import global_values
+from bd_scan_yocto import utils
+
+# Variables recorded as recipe annotations (SPDX_CUSTOM_ANNOTATION_VARS) which identify the layer
+LAYER_VARS = ['FILE_LAYERNAME', 'LAYERNAME']
+
+
+def find_spdx_docs(spdx_dir):
+    # Recipe documents in DEPLOY_DIR_SPDX are split into one recipes folder per package architecture
+    # (e.g. allarch, core2-64, MACHINE), so all of them are searched
+    recipes_dirs = []
+    for recipes_dir in sorted(glob.glob(os.path.join(spdx_dir, '**', 'recipes'), recursive=True)):
+        if len(glob.glob(os.path.join(recipes_dir, 'recipe-*.spdx.json'))) > 0:
+            recipes_dirs.append(recipes_dir)
+    if len(recipes_dirs) > 0:
+        return recipes_dirs
+
+    # Otherwise use the image SPDX archive (the default zstd compressed archive cannot be read by tarfile)
+    machine = global_values.machine.replace('_', '-')
+    imgdir = os.path.join(global_values.deploy_dir, "images", machine)
+    for ext in ['.spdx.tar.gz', '.spdx.tar.xz', '.spdx.tar.bz2', '.spdx.tar']:
+        archive = os.path.join(imgdir, f"{global_values.target}-{machine}{ext}")
+        if os.path.isfile(archive):
+            return [archive]
+    return []
+
+
+def read_recipe_docs(locations, recipes):
+    docs = {}
+    for location in locations:
+        if os.path.isdir(location):
+            read_recipe_dir(location, recipes, docs)
+        else:
+            read_recipe_archive(location, recipes, docs)
+    return docs
+
+
+def read_recipe_dir(location, recipes, docs):
+    for recipe in recipes:
+        docfile = os.path.join(location, f"recipe-{recipe}.spdx.json")
+        if recipe in docs.keys() or not os.path.isfile(docfile):
+            continue
+        try:
+            with open(docfile, 'r') as f:
+                docs[recipe] = json.load(f)
+        except Exception as e:
+            logging.debug(f"Unable to read SPDX document {docfile} - {str(e)}")
+
+
+def read_recipe_archive(location, recipes, docs):
+    try:
+        with tarfile.open(location, 'r:*') as tfile:
+            for member in tfile:
+                name = os.path.basename(member.name)
+                if not member.isfile() or not name.startswith('recipe-') or not name.endswith('.spdx.json'):
+                    continue
+                recipe = name[len('recipe-'):-len('.spdx.json')]
+                if recipe in recipes:
+                    docs[recipe] = json.load(tfile.extractfile(member))
+    except Exception as e:
+        logging.warning(f"Unable to read SPDX archive {location} - {str(e)}")
+
+
+def get_recipe_info(recipe, doc):
+    # Returns the download locations and layer (if recorded) from the recipe document
+    locations = []
+    layer = ''
+    for package in doc.get('packages', []):
+        if package.get('name', '').startswith(f"{recipe}-source-"):
+            location = package.get('downloadLocation', 'NOASSERTION')
+            if location not in ['NOASSERTION', 'NONE', '']:
+                locations.append(location)
+        elif package.get('name') == recipe:
+            for annotation in package.get('annotations', []):
+                arr = annotation.get('comment', '').split('=', 1)
+                if len(arr) == 2 and arr[0] in LAYER_VARS:
+                    layer = arr[1]
+    return locations, layer
+
+
+def resolve_download(location):
+    # Map an SPDX download location to the file or git mirror in DL_DIR, returning the path and git commit
+    if '+' in location.split('://')[0]:
+        fetcher = location.split('+')[0]
+        location = location[len(fetcher) + 1:]
+    else:
+        fetcher = location.split('://')[0]
+
+    rev = ''
+    if fetcher == 'git' and '@' in location:
+        location, rev = location.rsplit('@', 1)
+    url = urlparse(location)
+
+    if fetcher == 'git':
+        # Mirror folder naming used by the bitbake git fetcher
+        name = url.netloc.replace(':', '.') + url.path.replace('/', '.').replace('*', '.').replace(' ', '_')
+        path = os.path.join(global_values.download_dir, 'git2', name)
+        if not utils.is_git_repo(path) or rev == '':
+            return '', ''
+        commit = utils.get_git_commit(path, rev)
+        if commit == '':
+            return '', ''
+        return path, commit
+
+    path = os.path.join(global_values.download_dir, os.path.basename(url.path))
+    if url.path == '' or not os.path.isfile(path):
+        return '', ''
+    return path, ''
+
+
+def get_recipe_sources(recipes):
+    # Returns a dict of recipe -> list of (path, commit) for the source archives and git mirrors in DL_DIR,
+    # and a dict of recipe -> layer for the recipes with a layer recorded in SPDX
+    docs = read_recipe_docs(global_values.spdx_locations, recipes)
+    sources = {}
+    layers = {}
+    for recipe, doc in docs.items():
+        locations, layer = get_recipe_info(recipe, doc)
+        if layer != '':
+            layers[recipe] = layer
+        paths = []
+        for location in locations:
+            path, commit = resolve_download(location)
+            if path == '':
+                logging.debug(f"- Recipe:{recipe} - SPDX download {location} not found in download folder")
+                continue
+            paths.append((path, commit))
+        if len(paths) > 0:
+            sources[recipe] = paths
+
+    logging.info(f"- Read {len(docs)} recipe SPDX documents - located sources for {len(sources)} recipes and "
+                 f"layers for {len(layers)} recipes")
+    return sources, layers
@@ -0,0 +1,96 @@
+import os
+import fnmatch
+import logging
+
+from bd_scan_yocto import global_values
+
+source_exts = [
+    '.c', '.h', '.cc', '.cpp', '.cxx', '.c++', '.hh', '.hpp', '.hxx', '.h++', '.inl', '.ipp', '.tcc',
+    '.s', '.S', '.asm', '.m', '.mm', '.cu', '.cl', '.f', '.f90', '.f95', '.d', '.rs', '.go', '.java', '.kt',
+    '.scala', '.cs', '.swift', '.vala', '.py', '.pyx', '.pxd', '.pl', '.pm', '.xs', '.rb', '.php', '.lua',
+    '.tcl', '.js', '.mjs', '.ts', '.jsx', '.tsx', '.sh', '.bash', '.awk', '.sed', '.y', '.yy', '.l', '.ll',
+    '.proto', '.idl', '.ml', '.mli', '.hs', '.el', '.sql', '.cmake', '.am', '.ac', '.in', '.m4', '.mk', '.mak',
+    '.pro', '.pri', '.gn', '.gni', '.bzl', '.meson', '.def', '.sym', '.map', '.ld', '.lds', '.dts', '.dtsi',
+]
+
+# Files without a source extension which are still required for license/copyright matching or builds
+source_names = [
+    'license*', 'licence*', 'copying*', 'copyright*', 'notice*', 'authors*', 'readme*', 'makefile*',
+    'gnumakefile', 'kconfig*', 'kbuild', 'configure', 'cmakelists.txt', 'meson.build', 'meson_options.txt',
+    'setup.py', 'cargo.toml', 'go.mod', 'package.json', 'pom.xml', 'build.gradle',
+]
+
+source_exclude_paths = [
+    '*/testdata/*', '*/test-data/*', '*/fixtures/*', '*/doc/*', '*/docs/*',
+]
+
+skipped_files = 0
+skipped_bytes = 0
+
+
+def get_filter_settings():
+    # Settings which change the files kept when expanding archives
+    return [global_values.extract_profile, global_values.extract_include_exts, global_values.extract_exclude_exts,
+            global_values.extract_exclude_paths, global_values.extract_max_file_size]
+
+
+def reset_skipped():
+    global skipped_files, skipped_bytes
+
+    skipped_files = 0
+    skipped_bytes = 0
+
+
+def is_source_file(path):
+    name = os.path.basename(path).lower()
+    ext = os.path.splitext(path)[1]
+    if ext in source_exts or ext.lower() in source_exts:
+        return True
+    for pattern in source_names:
+        if fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+
+def include_member(path, size):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in global_values.extract_exclude_exts:
+        return False
+    if 0 < global_values.extract_max_file_size < size:
+        return False
+    exclude_paths = global_values.extract_exclude_paths
+    if global_values.extract_profile == 'source':
+        exclude_paths = exclude_paths + source_exclude_paths
+    if path.startswith('./'):
+        path = path[2:]
+    for pattern in exclude_paths:
+        if fnmatch.fnmatch('/' + path, pattern):
+            return False
+    if ext in global_values.extract_include_exts:
+        return True
+    if global_values.extract_profile == 'source':
+        return is_source_file(path)
+    return True
+
+
+def extract_tar(tfile, extract_dir):
+    global skipped_files, skipped_bytes
+
+    # Process members sequentially so filtering also works on streamed archives
+    for member in tfile:
+        if member.isdir():
+            continue
+        if not include_member(member.name, member.size):
+            skipped_files += 1
+            skipped_bytes += member.size
+            continue
+        try:
+            tfile.extract(member, extract_dir)
+        except Exception as e:
+            logging.debug(f"Unable to extract {member.name} - {str(e)}")
+
+
+def log_skipped():
+    if skipped_files > 0:
+        logging.info(f"- Skipped {skipped_files} non-source files ({skipped_bytes / (1024 * 1024):.1f} MB) "
+                     f"during extraction")
@@ -1,4 +1,4 @@
-# import os
+import os
 # import json
 # import sys
 import time
@@ -6,47 +6,98 @@ import time
 import subprocess
 import logging
 
+from bd_scan_yocto import srcfilter
 # from bd_scan_yocto import global_values
 # from bd_scan_yocto import config
 
 
-def get_projver(bd, pargs):
+# Resolved project and version resources, reused for the rest of the run
+projver_cache = {}
+
+
+def find_project(bd, project):
+    if project in projver_cache:
+        return projver_cache[project]
     params = {
-        'q': "name:" + pargs.project,
+        'q': "name:" + project,
         'sort': 'name',
     }
-    projects = bd.get_resource('projects', params=params, items=False)
+    # The name query also returns prefix matches so only accept an exact match
+    for proj in bd.get_resource('projects', params=params):
+        if proj['name'] == project:
+            projver_cache[project] = proj
+            return proj
+    return None
+
+
+def find_version(bd, proj, version):
+    key = (proj['name'], version)
+    if key in projver_cache:
+        return projver_cache[key]
+    params = {
+        'q': "versionName:" + version,
+    }
+    for ver in bd.get_resource('versions', parent=proj, params=params):
+        if ver['versionName'] == version:
+            projver_cache[key] = ver
+            return ver
+    return None
 
-    if projects['totalCount'] == 0:
-        logging.info(f"Project '{pargs.project}' does not exist yet")
-        return None, None
 
-    projects = bd.get_resource('projects', params=params)
-    for proj in projects:
-        versions = bd.get_resource('versions', parent=proj, params=params)
-        for ver in versions:
-            if ver['versionName'] == pargs.version:
-                return proj, ver
-    logging.info(f"Version '{pargs.project}' does not exist in project '{pargs.version}' yet")
-    return None, None
+def resolve_projver(bd, project, version):
+    proj = find_project(bd, project)
+    if proj is None:
+        return None, None
+    return proj, find_version(bd, proj, version)
 
 
-def patch_vuln(bd, comp):
+def get_projver(bd, pargs):
+    proj, ver = resolve_projver(bd, pargs.project, pargs.version)
+    if proj is None:
+        logging.info(f"Project '{pargs.project}' does not exist yet")
+        return None, None
+    if ver is None:
+        logging.info(f"Version '{pargs.version}' does not exist in project '{pargs.project}' yet")
+        return None, None
+    return proj, ver
+
+
+def remove_codelocations(bd, project, version, prefix, keep):
+    # Deletes code locations mapped to the version whose name starts with prefix and is not in keep, so scans
+    # from previous runs which are no longer produced do not remain in the BOM
+    proj, ver = resolve_projver(bd, project, version)
+    if ver is None:
+        return 0
+    removed = 0
+    for cl in bd.get_resource('codelocations', parent=ver):
+        if not cl['name'].startswith(prefix) or cl['name'] in keep:
+            continue
+        try:
+            r = bd.session.delete(cl['_meta']['href'])
+            r.raise_for_status()
+            logging.debug(f"- Removed obsolete code location {cl['name']}")
+            removed += 1
+        except Exception as e:
+            logging.warning(f"Unable to remove code location {cl['name']} - {str(e)}")
+    return removed
+
+
+async def async_patch_vuln(client, href):
     status = "PATCHED"
     comment = "Patched by bitbake recipe"
 
     try:
-        # vuln_name = comp['vulnerabilityWithRemediation']['vulnerabilityName']
-
-        comp['remediationStatus'] = status
-        comp['remediationComment'] = comment
+        # Only send the remediation fields rather than the full vulnerable component
+        data = {
+            'remediationStatus': status,
+            'comment': comment,
+        }
         # result = hub.execute_put(comp['_meta']['href'], data=comp)
-        href = comp['_meta']['href']
         # href = '/'.join(href.split('/')[3:])
-        r = bd.session.put(href, json=comp)
-        r.raise_for_status()
-        if r.status_code != 202:
-            return False
+        async with await client.request('PUT', href, json=data) as r:
+            r.raise_for_status()
+            if r.status != 202:
+                return False
 
     except Exception as e:
         logging.error("Unable to update vulnerabilities via API\n" + str(e))
@@ -119,3 +170,55 @@ def run_cmd(command):
     proc = subprocess.Popen(command, stdout=subprocess.PIPE, shell=True)
     proc_stdout = proc.communicate()[0].strip()
     return proc_stdout
+
+
+def is_git_repo(path):
+    return os.path.isdir(path) and os.path.isfile(os.path.join(path, 'HEAD')) and \
+        os.path.isdir(os.path.join(path, 'objects'))
+
+
+def get_git_commit(path, rev='HEAD'):
+    proc = subprocess.run(['git', '--git-dir', path, 'rev-parse', '--verify', '--quiet', f"{rev}^{{commit}}"],
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if proc.returncode != 0:
+        return ''
+    return proc.stdout.decode('utf-8').strip()
+
+
+def git_archive(path, commit, tmpdir, expand):
+    import tarfile
+
+    name = os.path.basename(path.rstrip('/'))
+    if name.endswith('.git'):
+        name = name[:-4]
+    prefix = f"{name}-{commit[:12]}"
+    cmd = ['git', '--git-dir', path, 'archive', '--format=tar', f"--prefix={prefix}/", commit]
+    try:
+        if expand:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            with tarfile.open(fileobj=proc.stdout, mode='r|') as tfile:
+                srcfilter.extract_tar(tfile, tmpdir)
+            proc.wait()
+        else:
+            proc = subprocess.run(cmd + ['-o', os.path.join(tmpdir, prefix + '.tar')],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if proc.returncode != 0:
+            logging.warning(f"Unable to archive commit {commit} from git repository {path}")
+            remove_git_archive(tmpdir, prefix)
+            return False
+    except Exception as e:
+        logging.warning(f"Unable to archive commit {commit} from git repository {path}\n" + str(e))
+        remove_git_archive(tmpdir, prefix)
+        return False
+
+    return True
+
+
+def remove_git_archive(tmpdir, prefix):
+    import shutil
+
+    # Remove partial output so the repository can be staged instead
+    if os.path.isdir(os.path.join(tmpdir, prefix)):
+        shutil.rmtree(os.path.join(tmpdir, prefix))
+    if os.path.isfile(os.path.join(tmpdir, prefix + '.tar')):
+        os.remove(os.path.join(tmpdir, prefix + '.tar'))
@@ -0,0 +1,119 @@
+import os
+import glob
+import time
+import logging
+
+from bd_scan_yocto import global_values
+from bd_scan_yocto import config
+from bd_scan_yocto import srcfilter
+from bd_scan_yocto import utils
+from bd_scan_yocto import workdir
+
+
+def get_latest_manifest():
+    # An explicit manifest file is watched directly
+    if config.args.manifest != '':
+        return config.args.manifest if os.path.isfile(config.args.manifest) else ''
+
+    machine = global_values.machine.replace('_', '-')
+    manpath = os.path.join(global_values.deploy_dir, "licenses",
+                           f"{global_values.target}-{machine}-*", "license.manifest")
+    manlist = glob.glob(manpath)
+    if len(manlist) == 0:
+        return ''
+    return max(manlist, key=get_mtime)
+
+
+def get_cve_file():
+    if config.args.no_cve_check:
+        return ''
+    if config.args.cve_check_file != '':
+        return config.args.cve_check_file
+
+    machine = global_values.machine.replace('_', '-')
+    return os.path.join(global_values.deploy_dir, "images", machine, f"{global_values.target}-{machine}.cve")
+
+
+def get_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def reset_scan_state():
+    # Clear the values collected by the previous scan, the bitbake environment and Black Duck connection are kept
+    global_values.bdio = []
+    global_values.bdio_comps_layers = []
+    global_values.bdio_comps_recipes = []
+    global_values.packages_list = []
+    global_values.recipes_dict = {}
+    global_values.recipe_layer_dict = {}
+    global_values.recipe_srcrev_dict = {}
+    global_values.git_mirror_revs = {}
+    global_values.spdx_sources = {}
+    global_values.pkg_recipe_dict = {}
+    global_values.layers_list = []
+    global_values.bdio_proj_rel_list = []
+    global_values.manifest_file = ''
+    global_values.cve_check_file = ''
+    global_values.cve_check = not config.args.no_cve_check
+    srcfilter.reset_skipped()
+    workdir.reset_staged()
+    # The project or version may have been deleted or recreated since the previous scan
+    utils.projver_cache.clear()
+
+
+def watch_builds(run_scan):
+    logging.info('----------------------------------   WATCH   ----------------------------------')
+    logging.info(f"Watching for new license.manifest and CVE check files every {global_values.watch_interval} seconds"
+                 f" (Ctrl-C to stop)")
+
+    # Files are only processed once unchanged for one polling interval so partially written outputs are skipped
+    last_scanned = {'manifest': ('', 0), 'cve': ('', 0)}
+    pending = {'manifest': ('', 0), 'cve': ('', 0)}
+    scan_count = 0
+    while True:
+        current = {}
+        manifest = get_latest_manifest() if not config.args.cve_check_only else ''
+        current['manifest'] = (manifest, get_mtime(manifest)) if manifest != '' else ('', 0)
+        cvefile = get_cve_file()
+        current['cve'] = (cvefile, get_mtime(cvefile)) if cvefile != '' and os.path.isfile(cvefile) else ('', 0)
+
+        full_scan = current['manifest'][0] != '' and current['manifest'] != last_scanned['manifest'] and \
+            current['manifest'] == pending['manifest']
+        cve_scan = current['cve'][0] != '' and current['cve'] != last_scanned['cve'] and \
+            current['cve'] == pending['cve']
+        pending = current
+
+        # A new manifest supersedes any change to the CVE file as the full scan also processes CVEs
+        if full_scan or cve_scan:
+            scan_count += 1
+            if full_scan:
+                logging.info(f"Watch scan {scan_count}: new license.manifest {current['manifest'][0]}")
+            else:
+                logging.info(f"Watch scan {scan_count}: updated CVE check file {current['cve'][0]}")
+
+            reset_scan_state()
+            if full_scan:
+                global_values.manifest_file = current['manifest'][0]
+            if current['cve'][0] != '':
+                global_values.cve_check_file = current['cve'][0]
+            else:
+                global_values.cve_check = False
+
+            start = time.time()
+            try:
+                run_scan(global_values.bd, not full_scan)
+                logging.info(f"Watch scan {scan_count} completed in {time.time() - start:.0f} seconds")
+            except SystemExit as e:
+                # Errors in one scan should not stop the watcher
+                logging.error(f"Watch scan {scan_count} failed (exit code {e.code}) - waiting for next build")
+            except Exception:
+                logging.exception(f"Watch scan {scan_count} failed - waiting for next build")
+            if full_scan:
+                last_scanned['manifest'] = current['manifest']
+            last_scanned['cve'] = current['cve']
+            continue
+
+        time.sleep(global_values.watch_interval)
@@ -0,0 +1,107 @@
+import os
+import re
+import glob
+import shutil
+import logging
+
+from bd_scan_yocto import global_values
+from bd_scan_yocto import srcfilter
+
+staged_count = 0
+fallback_count = 0
+
+
+def find_recipe_workdir(recipe):
+    # WORKDIR is TMPDIR/work/<arch>/<recipe>/<epoch:><version>-<release>, using the most recent if built
+    # for several architectures
+    ver = global_values.recipes_dict.get(recipe, '')
+    if global_values.tmp_dir == '' or ver == '':
+        return ''
+    ver = ver.split(':')[-1]
+    pattern = os.path.join(global_values.tmp_dir, 'work', '*', glob.escape(recipe), '*' + glob.escape(ver) + '*')
+    # Only accept this version with an optional epoch (<epoch>_) prefix and the +git suffix which is removed
+    # from the manifest version (e.g. 1.0+gitAUTOINC+0123456789-r0), not versions which contain it
+    ver_regex = re.compile(r'(\d+_)?' + re.escape(ver) + r'(\+[^-]*)?-[^-]+')
+    dirs = [path for path in glob.glob(pattern)
+            if os.path.isdir(path) and ver_regex.fullmatch(os.path.basename(path)) is not None]
+    if len(dirs) == 0:
+        return ''
+    return max(dirs, key=os.path.getmtime)
+
+
+def find_recipe_source(recipe):
+    # Returns the unpacked and patched source folder (S) for the recipe, or '' if it was removed by rm_work
+    workdir = find_recipe_workdir(recipe)
+    if workdir == '':
+        return ''
+    ver = global_values.recipes_dict[recipe].split(':')[-1]
+    # Default S locations, with sources unpacked to WORKDIR or UNPACKDIR (WORKDIR/sources)
+    for unpackdir in [workdir, os.path.join(workdir, 'sources')]:
+        for name in [f"{recipe}-{ver}", 'git', f"{recipe}-v{ver}", recipe]:
+            sdir = os.path.join(unpackdir, name)
+            if os.path.isdir(sdir) and len(os.listdir(sdir)) > 0:
+                return sdir
+    return ''
+
+
+def get_pkg_source(pkg):
+    if not global_values.use_workdir or pkg not in global_values.pkg_recipe_dict.keys():
+        return ''
+    return find_recipe_source(global_values.pkg_recipe_dict[pkg])
+
+
+def link_file(src, dest):
+    try:
+        os.link(src, dest)
+    except OSError:
+        # Different filesystem or links not supported
+        shutil.copy2(src, dest)
+
+
+def stage_source(pkg, tmpdir):
+    # Links the recipe source folder into tmpdir, returning False if not available so the package file is extracted
+    global staged_count, fallback_count
+
+    sdir = get_pkg_source(pkg)
+    if sdir == '':
+        fallback_count += 1
+        return False
+
+    recipe = global_values.pkg_recipe_dict[pkg]
+    dest = os.path.join(tmpdir, f"{recipe}-{global_values.recipes_dict[recipe].split(':')[-1]}")
+    if os.path.isdir(dest):
+        # Recipes with several source archives are staged once
+        return True
+
+    for root, dirs, files in os.walk(sdir):
+        relroot = os.path.relpath(root, sdir)
+        # Version control metadata is not required for scanning
+        dirs[:] = [d for d in dirs if d not in ['.git', '.pc', '.svn']]
+        os.makedirs(os.path.join(dest, relroot), exist_ok=True)
+        for file in files:
+            src = os.path.join(root, file)
+            relpath = os.path.normpath(os.path.join(relroot, file))
+            if os.path.islink(src) or not os.path.isfile(src):
+                continue
+            size = os.path.getsize(src)
+            if not srcfilter.include_member(relpath, size):
+                srcfilter.skipped_files += 1
+                srcfilter.skipped_bytes += size
+                continue
+            link_file(src, os.path.join(dest, relpath))
+    staged_count += 1
+    logging.debug(f"- Staged recipe source folder {sdir}")
+    return True
+
+
+def reset_staged():
+    global staged_count, fallback_count
+
+    staged_count = 0
+    fallback_count = 0
+
+
+def log_staged():
+    if global_values.use_workdir:
+        logging.info(f"- Staged {staged_count} recipe source folders from the build work folder, "
+                     f"{fallback_count} package files extracted (source folder not available)")
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# Measures the start up cost of bd_scan_yocto (module import and --help) in fresh interpreters and
+# reports whether the network and async stacks are loaded by the import.
+#
+# Usage: python benchmarks/startup.py [--runs N]
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['blackduck', 'requests', 'aiohttp', 'asyncio']
+
+IMPORT_CODE = '''
+import sys, json
+import bd_scan_yocto.main
+print(json.dumps([m for m in %r if m in sys.modules]))
+''' % HEAVY_MODULES
+
+
+def time_cmd(cmd, runs):
+    times = []
+    output = ''
+    for i in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run(cmd, cwd=REPO_DIR, capture_output=True, text=True)
+        times.append(time.perf_counter() - start)
+        output = proc.stdout
+    return times, output
+
+
+def report(name, times):
+    print(f"{name:<30} median {statistics.median(times) * 1000:8.1f} ms   "
+          f"min {min(times) * 1000:8.1f} ms   max {max(times) * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark bd_scan_yocto start up time')
+    parser.add_argument("--runs", help="Number of runs for each measurement (default 10)", type=int, default=10)
+    args = parser.parse_args()
+
+    times, _ = time_cmd([sys.executable, '-c', 'pass'], args.runs)
+    report('interpreter', times)
+
+    times, output = time_cmd([sys.executable, '-c', IMPORT_CODE], args.runs)
+    report('import bd_scan_yocto.main', times)
+    if output.strip() != '':
+        loaded = json.loads(output.strip().splitlines()[-1])
+        print(f"  heavy modules loaded by import: {', '.join(loaded) if loaded else 'none'}")
+
+    times, _ = time_cmd([sys.executable, 'main.py', '--help'], args.runs)
+    report('bd_scan_yocto --help', times)
+
+
+if __name__ == "__main__":
+    main()